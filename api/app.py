@@ -2,6 +2,7 @@
 import logging
 from pathlib import Path
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from api.weather_services import RegionIndex
@@ -23,7 +24,8 @@ load_dotenv()
 app = FastAPI(
     title="WeatherPro Vietnam",
     description="Weather data aggregation service for Vietnam regions",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,  # orjson: encode nhanh hơn, NaN → null
 )
 
 # ==============================
@@ -50,10 +52,10 @@ def _load_index(path: Path, label: str):
             raise FileNotFoundError(f"{label} not found at {path}")
         idx = RegionIndex(str(path))
         features = getattr(idx, "features", [])
-        logger.info(f"✅ Loaded {label} from {path} with {len(features)} entries")
+        logger.info("✅ Loaded %s from %s with %d entries", label, path, len(features))
         return idx
     except Exception as e:
-        logger.error(f"❌ Failed to load {label} from {path}: {e}")
+        logger.error("❌ Failed to load %s from %s: %s", label, path, e)
         return None
 
 regions = _load_index(regions_path, "Vietnam provinces")
@@ -1,30 +1,23 @@
 # api/app_utils.py
-import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
-from api.weather_services import interpolate_to_24h, detect_alerts, bias_correct
+from api.weather_services import interpolate_to_24h, detect_alerts, bias_correct, strip_accents
 from services.bulletin import generate_bulletin
 from services.current_summary import generate_current_summary, summarize_current
 from services.openweather import OWM
 from services.weatherapi import WeatherAPI
 from services.openmeteo import OpenMeteo
+from services.cache import FETCH_TTL, TTLCache
 
 
 # ------------------- UTILS -------------------
-def strip_accents(text: str) -> str:
-    """Bỏ dấu tiếng Việt để chuẩn hóa tên địa danh."""
-    text = unicodedata.normalize("NFD", text)
-    text = text.encode("ascii", "ignore").decode("utf-8")
-    return str(text)
-
-
 def find_region(region_norm: str, region_list, source_name: str):
     """Tìm địa danh trong RegionIndex theo tên chuẩn hóa."""
-    for feat in region_list.features:
-        name_norm = strip_accents(feat["properties"]["name"].lower())
-        if region_norm == name_norm:
-            return feat, source_name
+    feat = region_list.lookup(region_norm)
+    if feat is not None:
+        return feat, source_name
     return None, None
 
 
@@ -56,43 +49,94 @@ def _pick_latest_row(df: pd.DataFrame, time_col: str):
     """Lấy bản ghi mới nhất theo time_col."""
     if not time_col:
         return None
-    s = df.dropna(subset=[time_col]).sort_values(time_col)
-    if s.empty:
+    # Một lượt tìm max (O(n)) thay vì dropna + sort cả frame
+    ts = df[time_col].reset_index(drop=True)
+    if not ts.notna().any():
         return None
-    return s.iloc[-1]
+    return df.iloc[ts.idxmax()]
 
 
 def _slice_next_24h(df: pd.DataFrame, time_col: str, now: pd.Timestamp | None = None) -> pd.DataFrame:
     """Lọc dải giờ từ thời điểm hiện tại (UTC) đến +24h."""
     if not time_col or not isinstance(df, pd.DataFrame) or df.empty:
         return pd.DataFrame()
-    now = now or pd.Timestamp.utcnow().tz_localize("UTC")
-    end = now + pd.Timedelta(hours=24)
-    s = df.dropna(subset=[time_col])
-    s = s[(s[time_col] >= now) & (s[time_col] <= end)].sort_values(time_col)
-    return s
+    now = pd.Timestamp.now(tz="UTC") if now is None else pd.Timestamp(now)
+    if now.tzinfo is not None:
+        now = now.tz_convert("UTC").tz_localize(None)
+    start = now.to_datetime64()
+    end = start + np.timedelta64(24, "h")
+    # Mask NumPy trên datetime64 UTC (NaT luôn cho False nên tự loại)
+    ts = df[time_col].to_numpy(dtype="datetime64[ns]")
+    idx = np.flatnonzero((ts >= start) & (ts <= end))
+    idx = idx[np.argsort(ts[idx], kind="stable")]
+    return df.iloc[idx]
 
 
 # ------------------- SOURCE COLLECTOR -------------------
+# Pool dùng chung để gọi song song forecast/current của cùng một nguồn (I/O-bound)
+_FETCH_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="fetch")
+
+
+# Dữ liệu thời tiết còn dùng được một lúc → cache theo (hàm, lat, lon) đã làm tròn, TTL theo loại (FETCH_TTL)
+_FETCH_CACHE = TTLCache(ttl=FETCH_TTL["forecast"], maxsize=2048)
+
+
+def _safe_fetch(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        print(f"⚠️ Lỗi khi gọi {getattr(fn, '__name__', fn)}: {e}")
+        return None
+
+
+def _is_empty(result) -> bool:
+    if result is None:
+        return True
+    if isinstance(result, pd.DataFrame):
+        return result.empty
+    if isinstance(result, dict) and result and all(isinstance(v, pd.DataFrame) for v in result.values()):
+        return all(v.empty for v in result.values())  # kết quả fetch_forecast
+    return not result
+
+
+def _cached_fetch(fn, lat: float, lon: float, **kwargs):
+    """
+    Như _safe_fetch nhưng dùng lại kết quả còn hạn; không cache kết quả rỗng/lỗi.
+    Nguồn lỗi hoặc trả về rỗng → dùng bản cũ (đã hết hạn) nếu có, như _fetch_one của services/etl.
+    """
+    key = (fn.__qualname__, round(lat, 2), round(lon, 2), tuple(sorted(kwargs.items())))
+    result = _FETCH_CACHE.get(key)
+    if result is None:
+        result = _safe_fetch(fn, lat, lon, **kwargs)
+        if _is_empty(result):
+            return _FETCH_CACHE.get_stale(key, result)
+        _FETCH_CACHE.set(key, result, ttl=FETCH_TTL.get(fn.__name__.removeprefix("fetch_")))
+    return result
+
+
+def _fetch_source(source, lat: float, lon: float):
+    """
+    Gọi đồng thời forecast (hourly 24h + daily 10 ngày trong một request) và current của một nguồn;
+    trả về tuple (hourly, daily, current).
+    """
+    if source is None:
+        return None, None, None
+    forecast = _FETCH_POOL.submit(_cached_fetch, source.fetch_forecast, lat, lon, hours=24, days=10)
+    current = _FETCH_POOL.submit(_cached_fetch, source.fetch_current, lat, lon)
+    forecast = forecast.result() or {}
+    return forecast.get("hourly"), forecast.get("daily"), current.result()
+
+
 def _collect_sources(lat: float, lon: float):
     """
     Gọi dữ liệu từ WeatherAPI (chính), OpenMeteo (phụ), OWM (fallback).
+    Trong mỗi nguồn, 2 request forecast (hourly + daily)/current chạy song song.
     Trả về dict gồm:
       - primary: dữ liệu chính để hiển thị
       - originals: dữ liệu gốc từ từng nguồn để debug/đối chiếu
     """
-
-    def safe_fetch(fn, *args, **kwargs):
-        try:
-            return fn(*args, **kwargs)
-        except Exception as e:
-            print(f"⚠️ Lỗi khi gọi {fn.__name__}: {e}")
-            return None
-
     # WeatherAPI (chính thức)
-    wa_hourly = safe_fetch(WeatherAPI.fetch_hourly, lat, lon, hours=24)
-    wa_daily = safe_fetch(WeatherAPI.fetch_daily, lat, lon, days=10)
-    wa_current = safe_fetch(WeatherAPI.fetch_current, lat, lon)
+    wa_hourly, wa_daily, wa_current = _fetch_source(WeatherAPI, lat, lon)
 
     if wa_current or (isinstance(wa_hourly, pd.DataFrame) and not wa_hourly.empty):
         return {
@@ -105,9 +149,7 @@ def _collect_sources(lat: float, lon: float):
         }
 
     # Open-Meteo (phụ)
-    om_hourly = safe_fetch(OpenMeteo.fetch_hourly, lat, lon, hours=24)
-    om_daily = safe_fetch(OpenMeteo.fetch_daily, lat, lon, days=10)
-    om_current = safe_fetch(OpenMeteo.fetch_current, lat, lon)
+    om_hourly, om_daily, om_current = _fetch_source(OpenMeteo, lat, lon)
 
     if om_current or (isinstance(om_hourly, pd.DataFrame) and not om_hourly.empty):
         return {
@@ -120,9 +162,7 @@ def _collect_sources(lat: float, lon: float):
         }
 
     # OWM (fallback cuối cùng)
-    owm_hourly = safe_fetch(OWM.fetch_hourly, lat, lon, hours=24)
-    owm_daily = safe_fetch(OWM.fetch_daily, lat, lon, days=10)
-    owm_current = safe_fetch(OWM.fetch_current, lat, lon)
+    owm_hourly, owm_daily, owm_current = _fetch_source(OWM, lat, lon)
 
     return {
         "primary": {"hourly": owm_hourly, "daily": owm_daily, "current": owm_current},
@@ -137,23 +177,25 @@ def _collect_sources(lat: float, lon: float):
 # ------------------- CORE RESPONSE -------------------
 def _sanitize_for_json(obj):
     """Làm sạch NaN/NaT trong cấu trúc dữ liệu lồng nhau để JSON hợp lệ."""
+    # Lá phổ biến nhất trả về ngay, không qua pd.isna
+    if obj is None or isinstance(obj, (str, bool, np.bool_)):
+        return obj
+    if isinstance(obj, (float, np.floating)):
+        return None if obj != obj else obj
+    if isinstance(obj, (int, np.integer)):
+        return obj
+    if isinstance(obj, dict):
+        return {k: _sanitize_for_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_sanitize_for_json(item) for item in obj]
+    # DataFrame: một lượt pandas (astype(object) để NaN số cũng thành None)
     if isinstance(obj, pd.DataFrame):
-        return obj.where(pd.notnull(obj), None).to_dict(orient="records")
+        return obj.astype(object).where(obj.notna(), None).to_dict(orient="records")
     if isinstance(obj, pd.Series):
         return _sanitize_for_json(obj.to_dict())
     if isinstance(obj, np.ndarray):
         return _sanitize_for_json(obj.tolist())
-    if isinstance(obj, list):
-        return [_sanitize_for_json(item) for item in obj]
-    if isinstance(obj, dict):
-        return {k: _sanitize_for_json(v) for k, v in obj.items()}
     try:
-        if isinstance(obj, (np.floating, float)) and np.isnan(obj):
-            return None
-        if isinstance(obj, (np.integer, int)):
-            return obj
-        if isinstance(obj, (np.bool_, bool)):
-            return obj
         if isinstance(obj, pd.Timestamp):
             return None if pd.isna(obj) else obj.isoformat()
         return None if pd.isna(obj) else obj
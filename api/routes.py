@@ -7,7 +7,7 @@ from services.openweather import OWM
 from services.weatherapi import WeatherAPI
 from services.openmeteo import OpenMeteo
 from api.weather_services import weighted_ensemble
-from api.app_utils import _collect_sources, strip_accents, find_region
+from api.app_utils import _collect_sources, _fetch_source, strip_accents, find_region
 from api.app import regions, wards
 from services.bulletin import generate_bulletin
 
@@ -88,9 +88,7 @@ def chat(region: str, group_hours: bool = Query(False)):
 
     except Exception:
         logger.exception("Error in chat, fallback to OWM")
-        hourly = OWM.fetch_hourly(lat, lon, hours=24)
-        daily = OWM.fetch_daily(lat, lon, days=10)
-        current = OWM.fetch_current(lat, lon)
+        hourly, daily, current = _fetch_source(OWM, lat, lon)
 
         hourly_df = hourly if isinstance(hourly, pd.DataFrame) else pd.DataFrame()
         daily_df  = daily if isinstance(daily, pd.DataFrame) else pd.DataFrame()
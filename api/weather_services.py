@@ -1,7 +1,13 @@
 # services/weather_services.py
+import unicodedata
+from functools import cached_property, lru_cache
 import pandas as pd
-import json
+import numpy as np
+import orjson
 from shapely.geometry import shape, Point
+from shapely.strtree import STRtree
+
+from services.timeutils import ensure_ts
 
 # =========================
 # 1. INTERPOLATE
@@ -15,16 +21,19 @@ def interpolate_to_24h(hourly_df: pd.DataFrame) -> pd.DataFrame:
     if hourly_df is None or not isinstance(hourly_df, pd.DataFrame) or hourly_df.empty:
         raise ValueError("hourly_df rỗng hoặc không tồn tại")
 
-    df = hourly_df.copy()
-    if "ts" not in df.columns:
+    if "ts" not in hourly_df.columns:
         raise ValueError("hourly_df thiếu cột 'ts'")
 
-    df["ts"] = pd.to_datetime(df["ts"], errors="coerce", utc=True)
-    df = df.dropna(subset=["ts"])
-    if df.empty:
+    ts = ensure_ts(hourly_df["ts"])
+    valid = ts.notna().to_numpy()
+    if not valid.any():
         raise ValueError("hourly_df không có dữ liệu thời gian hợp lệ")
 
-    df = df.set_index("ts").sort_index()
+    # Chỉ lấy các cột cần dùng (một bản sao hẹp thay vì copy toàn bộ frame)
+    keep = [c for c in ["temp", "rain", "wind_speed", "weather_desc"] if c in hourly_df.columns]
+    df = hourly_df.loc[valid, keep].set_index(pd.DatetimeIndex(ts[valid], name="ts"))
+    if not df.index.is_monotonic_increasing:   # dữ liệu API thường đã theo thứ tự → bỏ qua sort
+        df = df.sort_index()
 
     # Xác định dải ngày đầy đủ theo giờ
     start, end = df.index.min(), df.index.max()
@@ -39,13 +48,25 @@ def interpolate_to_24h(hourly_df: pd.DataFrame) -> pd.DataFrame:
     if not numeric_cols:
         raise ValueError("hourly_df thiếu các cột số bắt buộc: temp, rain, wind_speed")
 
-    # Nội suy và lấp đầy
-    df_interp = df[numeric_cols].reindex(full_range)
-    df_interp = df_interp.interpolate(method="linear").ffill().bfill()
-
-    # Mô tả thời tiết: chọn bản ghi gần nhất
+    # Nội suy tuyến tính theo thời gian lên lưới giờ bằng np.interp
+    # (hai đầu giữ giá trị biên — tương đương ffill/bfill cũ)
+    xp = df.index.as_unit("ns").asi8
+    grid = full_range.as_unit("ns").asi8
+    interp = {}
+    for col in numeric_cols:
+        fp = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+        ok = ~np.isnan(fp)
+        interp[col] = np.interp(grid, xp[ok], fp[ok]) if ok.any() else np.full(len(grid), np.nan)
+    df_interp = pd.DataFrame(interp, index=full_range)
+
+    # Mô tả thời tiết: chọn bản ghi gần nhất (searchsorted; cách đều thì lấy mốc sau như reindex nearest)
     if "weather_desc" in df.columns:
-        df_interp["weather_desc"] = df["weather_desc"].reindex(full_range, method="nearest")
+        n = len(xp)
+        li = np.searchsorted(xp, grid, side="right") - 1
+        ri = np.searchsorted(xp, grid, side="left")
+        lc, rc = li.clip(0, n - 1), ri.clip(0, n - 1)
+        take_left = (ri >= n) | ((li >= 0) & (grid - xp[lc] < xp[rc] - grid))
+        df_interp["weather_desc"] = df["weather_desc"].to_numpy()[np.where(take_left, lc, rc)]
 
     df_interp = df_interp.reset_index().rename(columns={"index": "ts"})
     return df_interp
@@ -67,7 +88,9 @@ def region_representative(hourly_df: pd.DataFrame, region_name: str) -> pd.DataF
 
     # Chỉ số nhiệt độ cảm nhận đơn giản (heat index proxy)
     # Công thức proxy: T + 0.33 * RH(%) / 100 * T - 4
-    df["heat_index_proxy"] = df["temp"] + 0.33 * (df["humidity"] / 100.0) * df["temp"] - 4
+    t = df["temp"].to_numpy(dtype=float)
+    rh = df["humidity"].to_numpy(dtype=float)
+    df["heat_index_proxy"] = t + 0.33 * (rh / 100.0) * t - 4
     df["region"] = region_name
     return df
 
@@ -75,6 +98,16 @@ def region_representative(hourly_df: pd.DataFrame, region_name: str) -> pd.DataF
 # =========================
 # 3. ALERTS
 # =========================
+# (type, severity) theo đúng thứ tự cột của ma trận luật trong detect_alerts
+HOURLY_ALERT_RULES = (
+    ("heavy_rain", "severe"),
+    ("heavy_rain", "moderate"),
+    ("heat", "moderate"),
+    ("heat", "severe"),
+    ("wind", "severe"),
+    ("wind", "moderate"),
+)
+
 def detect_alerts(hourly_df: pd.DataFrame, daily_df: pd.DataFrame = None, current: dict = None):
     """
     Phát hiện cảnh báo dựa trên ngưỡng đơn giản:
@@ -86,27 +119,45 @@ def detect_alerts(hourly_df: pd.DataFrame, daily_df: pd.DataFrame = None, curren
     """
     alerts = []
 
-    # Phân tích hourly
+    # Phân tích hourly (vector hóa theo cột thay cho iterrows)
     if isinstance(hourly_df, pd.DataFrame) and not hourly_df.empty:
-        for _, row in hourly_df.iterrows():
-            ts = row.get("ts")
-            rain = row.get("rain", 0) or 0
-            temp = row.get("temp", 0) or 0
-            wind = row.get("wind_speed", 0) or 0
-            heat_index = row.get("heat_index_proxy", temp) or temp
-
-            if rain >= 30:
-                alerts.append({"ts": ts, "type": "heavy_rain", "severity": "severe"})
-            elif rain >= 10:
-                alerts.append({"ts": ts, "type": "heavy_rain", "severity": "moderate"})
-            if temp >= 35:
-                alerts.append({"ts": ts, "type": "heat", "severity": "moderate"})
-            if heat_index >= 38:
-                alerts.append({"ts": ts, "type": "heat", "severity": "severe"})
-            if wind >= 17:
-                alerts.append({"ts": ts, "type": "wind", "severity": "severe"})
-            elif wind >= 10:
-                alerts.append({"ts": ts, "type": "wind", "severity": "moderate"})
+        n = len(hourly_df)
+
+        def col(name):
+            if name not in hourly_df.columns:
+                return np.zeros(n)
+            return pd.to_numeric(hourly_df[name], errors="coerce").to_numpy(dtype=float)
+
+        ts = hourly_df["ts"].tolist() if "ts" in hourly_df.columns else [None] * n
+        rain = col("rain")
+        temp = col("temp")
+        wind = col("wind_speed")
+        # Như `row.get("heat_index_proxy", temp) or temp`: thay bằng temp khi thiếu cột, bằng 0
+        # hoặc là None trong cột object (NaN giữ nguyên, không kích hoạt cảnh báo)
+        if "heat_index_proxy" in hourly_df.columns:
+            raw = hourly_df["heat_index_proxy"]
+            heat_index = col("heat_index_proxy")
+            falsy = heat_index == 0
+            if pd.api.types.is_object_dtype(raw):
+                falsy |= (raw.isna() & raw.map(lambda v: v is None)).to_numpy(dtype=bool)
+            heat_index = np.where(falsy, temp, heat_index)
+        else:
+            heat_index = temp
+
+        # Mỗi cột của ma trận là một luật; np.nonzero duyệt theo hàng nên giữ nguyên thứ tự cũ
+        masks = np.column_stack([
+            rain >= 30,
+            (rain >= 10) & (rain < 30),
+            temp >= 35,
+            heat_index >= 38,
+            wind >= 17,
+            (wind >= 10) & (wind < 17),
+        ])
+        rows, kinds = np.nonzero(masks)
+        alerts.extend(
+            {"ts": ts[i], "type": HOURLY_ALERT_RULES[k][0], "severity": HOURLY_ALERT_RULES[k][1]}
+            for i, k in zip(rows.tolist(), kinds.tolist())
+        )
 
     # Phân tích daily
     if isinstance(daily_df, pd.DataFrame) and not daily_df.empty:
@@ -149,9 +200,9 @@ def weighted_ensemble(dfs, weights=None):
 
         # Chuẩn hóa cột thời gian
         if "ts" in df.columns:
-            df["ts"] = pd.to_datetime(df["ts"], errors="coerce", utc=True)
+            df["ts"] = ensure_ts(df["ts"])
         elif "date" in df.columns:
-            df["ts"] = pd.to_datetime(df["date"], errors="coerce", utc=True)
+            df["ts"] = ensure_ts(df["date"])
         else:
             raise ValueError("DataFrame must contain 'ts' or 'date' column")
 
@@ -159,39 +210,65 @@ def weighted_ensemble(dfs, weights=None):
         df["weight"] = float(w)
         normalized.append(df)
 
-    # Lọc bỏ DataFrame toàn NaN
-    normalized = [df for df in normalized if not df.dropna(how="all").empty]
+    # DataFrame rỗng đã bị loại trong vòng lặp trên (cột weight luôn có giá trị nên dropna(how="all") không loại thêm gì)
     if not normalized:
         raise ValueError("All dataframes are empty or all-NA")
 
-    # Ghép lại
+    # Ghép lại: kiểu của từng cột vẫn do pd.concat quyết định như trước (cột toàn None của
+    # một nguồn có thể không làm mất cột số của nguồn khác, tùy cách pandas gom block)
     merged = pd.concat(normalized, ignore_index=True)
 
-    if "ts" not in merged.columns:
-        raise ValueError("DataFrames must contain 'ts' column")
-
-    grouped = merged.groupby("ts", sort=False)
+    # Mã hóa ts một lần trên toàn bộ nguồn: thứ tự xuất hiện như groupby(sort=False), NaT → -1
+    codes, uniques = pd.factorize(merged["ts"])
+    n_ts = len(uniques)
 
     # Các cột numeric cần ensemble (bao gồm min/max/avg)
     numeric_cols = [
         "temp", "temp_min", "temp_max", "temp_avg",
         "humidity", "pressure", "wind_speed", "clouds", "rain"
     ]
-
-    def aggregate_group(g: pd.DataFrame) -> pd.Series:
-        result = {}
-        total_weight = g["weight"].sum() if "weight" in g.columns else 0.0
-        for col in numeric_cols:
-            if col in g.columns and pd.api.types.is_numeric_dtype(g[col]) and total_weight > 0:
-                result[col] = (g[col] * g["weight"]).sum() / total_weight
-            else:
-                result[col] = None
-        # giữ lại cột mô tả nếu có
-        if "weather_desc" in g.columns and not g["weather_desc"].isna().all():
-            result["weather_desc"] = g["weather_desc"].dropna().iloc[0]
-        return pd.Series(result)
-
-    out = grouped.apply(aggregate_group, include_groups=False).reset_index()
+    cols = [c for c in numeric_cols if c in merged.columns and pd.api.types.is_numeric_dtype(merged[c])]
+    block = merged[cols].to_numpy(dtype=float)
+
+    # Cộng dồn tổng có trọng số theo mã ts, không qua groupby (NaN tính là 0, trọng số vẫn cộng)
+    acc = np.zeros((n_ts, len(cols)))
+    total_weight = np.zeros(n_ts)
+    has_desc = any("weather_desc" in df.columns for df in normalized)
+    desc = np.full(n_ts, None, dtype=object)
+    desc_set = np.zeros(n_ts, dtype=bool)
+
+    offset = 0
+    for df in normalized:
+        pos = codes[offset:offset + len(df)]
+        offset += len(df)
+        ok = pos >= 0
+        w = df["weight"].iat[0]
+        vals = block[offset - len(df):offset]
+        np.add.at(acc, pos[ok], np.nan_to_num(vals[ok], nan=0.0) * w)
+        np.add.at(total_weight, pos[ok], w)
+
+        # weather_desc: bản ghi không rỗng đầu tiên của mỗi mốc
+        if "weather_desc" in df.columns:
+            d = df["weather_desc"].to_numpy(dtype=object)
+            m = ok & pd.notna(d)
+            first_pos, first_idx = np.unique(pos[m], return_index=True)
+            new = ~desc_set[first_pos]
+            desc[first_pos[new]] = d[m][first_idx[new]]
+            desc_set[first_pos[new]] = True
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = acc / np.where(total_weight > 0, total_weight, np.nan)[:, None]
+
+    out = pd.DataFrame(mean, columns=cols, index=pd.Index(uniques, name="ts"))
+    for col in numeric_cols:
+        if col not in out.columns:
+            out[col] = None
+    out = out[numeric_cols]
+
+    if has_desc and desc_set.any():
+        out["weather_desc"] = desc
+
+    out = out.rename_axis("ts").reset_index()
 
     # Thay NaN bằng None để JSON hợp lệ
     out = out.where(pd.notnull(out), None)
@@ -201,26 +278,65 @@ def weighted_ensemble(dfs, weights=None):
 # =========================
 # 5. REGIONS
 # =========================
+@lru_cache(maxsize=4096)
+def strip_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt để chuẩn hóa tên địa danh."""
+    text = unicodedata.normalize("NFD", text)
+    text = text.encode("ascii", "ignore").decode("utf-8")
+    return str(text)
+
+
 class RegionIndex:
     def __init__(self, geojson_path: str):
-        with open(geojson_path, "r", encoding="utf-8") as f:
-            gj = json.load(f)
+        with open(geojson_path, "rb") as f:
+            gj = orjson.loads(f.read())
         self.features = gj.get("features", [])
 
+        # Tên chuẩn hóa → feature (giữ feature đầu tiên nếu trùng tên)
+        self._by_norm_name = {}
+        for feat in self.features:
+            name = (feat.get("properties") or {}).get("name")
+            if name:
+                self._by_norm_name.setdefault(strip_accents(name.lower()), feat)
+
+    # Hình học và STRtree chỉ dựng ở lần find_region đầu tiên (tra cứu theo tên không cần tới)
+    @cached_property
+    def _geom_feats(self):
+        return [f for f in self.features if f.get("geometry")]
+
+    @cached_property
+    def _geoms(self):
+        return [shape(f["geometry"]) for f in self._geom_feats]
+
+    @cached_property
+    def _tree(self):
+        return STRtree(self._geoms)
+
+    @cached_property
+    def _centroids(self):
+        """Tâm của từng hình (tính một lần khi cần lần đầu)."""
+        return [g.centroid.coords[0] for g in self._geoms]
+
+    def lookup(self, norm_name: str):
+        """Tra feature theo tên đã chuẩn hóa (strip_accents + lower)."""
+        return self._by_norm_name.get(norm_name)
+
     def find_region(self, lat: float, lon: float):
         """
         Tìm vùng chứa tọa độ (lat, lon).
         """
         p = Point(lon, lat)
-        for feat in self.features:
-            polygon = shape(feat["geometry"])
-            if polygon.contains(p):
-                return {
-                    "region_id": feat["properties"].get("id"),
-                    "name": feat["properties"].get("name"),
-                    "centroid": polygon.centroid.coords[0]
-                }
-        return None
+        # Lọc bbox + kiểm tra contains đều chạy trong GEOS (p within polygon ⇔ polygon contains p)
+        hits = self._tree.query(p, predicate="within")
+        if len(hits) == 0:
+            return None
+        i = int(hits.min())  # giữ thứ tự cũ: feature đầu tiên trong file
+        feat = self._geom_feats[i]
+        return {
+            "region_id": feat["properties"].get("id"),
+            "name": feat["properties"].get("name"),
+            "centroid": self._centroids[i]
+        }
 
 
 # =========================
@@ -236,13 +352,23 @@ def bias_correct(data, bias_stats: dict):
     if isinstance(data, pd.DataFrame):
         if data.empty:
             return data
-        df = data.copy()
-        for var, bias in (bias_stats or {}).items():
-            if var in df.columns and pd.api.types.is_numeric_dtype(df[var]):
-                df[var] = df[var] - bias
+        # Copy nông: chỉ các cột được trừ bias mới thay mảng mới, dữ liệu gốc không bị sửa
+        df = data.copy(deep=False)
+        bias_stats = bias_stats or {}
+        cols = [c for c in bias_stats if c in df.columns and pd.api.types.is_numeric_dtype(df[c])]
+        if cols:
+            # Trừ bias cho cả khối cột trong một phép NumPy
+            vec = np.fromiter((bias_stats[c] for c in cols), dtype=np.float64, count=len(cols))
+            arr = df[cols].to_numpy(dtype=np.float64, copy=True)
+            arr -= vec
+            df[cols] = arr
+            # Cột nguyên trừ bias nguyên vẫn là cột nguyên (như phép trừ từng cột của pandas)
+            for c in cols:
+                dtype = (data[c].iloc[:0] - bias_stats[c]).dtype
+                if dtype.kind in "iu":
+                    df[c] = df[c].astype(dtype)
         # Thay NaN bằng None để JSON hợp lệ
-        df = df.where(pd.notnull(df), None)
-        return df
+        return df.where(pd.notnull(df), None)
 
     # Dict (current)
     elif isinstance(data, dict):
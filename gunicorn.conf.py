@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+import os
+
+# ==============================
+# Server socket
+# ==============================
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# ==============================
+# Workers
+# ==============================
+# Mỗi worker là một tiến trình uvicorn (uvloop + httptools có sẵn trong uvicorn[standard]).
+# App chủ yếu chờ I/O nên vài worker là đủ; cache fetch/bản tin, gom request trùng (_INFLIGHT)
+# và pool luồng đều nằm riêng trong từng tiến trình → thêm worker làm giảm tỉ lệ trúng cache
+# và nhân số lần gọi các API thời tiết bị giới hạn lượt. Mặc định 2, đổi qua WEB_CONCURRENCY.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_tmp_dir = "/dev/shm"
+
+# Load app một lần ở master: index GeoJSON được chia sẻ copy-on-write cho các worker
+preload_app = True
+
+timeout = 60
+keepalive = 5
@@ -1,13 +1,18 @@
 # services/bulletin.py
+import hashlib
+import math
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from pytz import timezone
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from services.storm_alert import check_storm_alert
 from services.unusual_alert import check_unusual_alert
 from services.current_summary import generate_current_summary
+from services.cache import TTLCache
+from services.timeutils import ensure_ts
 
-# Khai báo múi giờ
-ICT = timezone("Asia/Bangkok")
+# Khai báo múi giờ: ICT cố định UTC+7 (không có giờ mùa hè); tên "+07" giữ nguyên hiển thị %Z
+ICT = timezone(timedelta(hours=7), "+07")
 
 # Ngưỡng cảnh báo
 RAIN_DAILY_ALERT = 30.0   # mm
@@ -18,20 +23,70 @@ HUMID_ALERT = 85          # %
 VERY_HUMID = 90           # %
 MUGGY_TEMP = 28.0         # °C (nóng nhẹ trở lên)
 
+# Mức tổng quan trong ngày → (icon tiêu đề, mô tả fallback), theo thứ tự ưu tiên
+OVERVIEW_LEVELS = (
+    ("⛈️", "Mưa lớn"),
+    ("🌧️", "Có mưa"),
+    ("💨", "Gió mạnh"),
+    ("🔥", "Nắng nóng"),
+    ("❄️", "Trời lạnh"),
+    ("🌤️", "Thời tiết ôn hòa"),
+)
+
+# Icon tiêu đề theo loại khối → các luật (điều kiện, icon) theo thứ tự ưu tiên; không khớp → 🌤️
+HEADER_ICON_RULES = {
+    "title":   (("rain", "🌧️"), ("sun", "☀️"), ("cloud", "☁️"), ("cold", "❄️"), ("hot", "🔥")),
+    "current": (("rain", "🌦️"), ("sun", "☀️"), ("cloud", "☁️"), ("windy", "💨")),
+}
+
+# Icon theo giờ/ngày: mưa, nắng, mây, gió mạnh, nóng, lạnh (theo thứ tự ưu tiên)
+WEATHER_ICONS = ("🌦️", "☀️", "☁️", "💨", "🔥", "❄️")
+
+# Bản tin cùng dữ liệu trong cùng một phút cho ra cùng nội dung → cache theo vân tay đầu vào + phút
+BULLETIN_CACHE_TTL = 60  # giây
+_BULLETIN_CACHE = TTLCache(ttl=BULLETIN_CACHE_TTL, maxsize=256)
+
+# ===== TIỆN ÍCH =====
+
+def _num(x) -> float | None:
+    """Số hữu hạn → float; None, NaN, chuỗi... → None. Kiểm tra kiểu một lần cho mỗi giá trị."""
+    return float(x) if isinstance(x, (int, float)) and math.isfinite(x) else None
+
+def _col_values(df: pd.DataFrame, name: str, default=None) -> list:
+    """Cột → list scalar Python (giống giá trị khi iterrows); thiếu cột thì lặp default."""
+    return df[name].tolist() if name in df.columns else [default] * len(df)
+
 # ===== NHẬN ĐỊNH =====
 
+@lru_cache(maxsize=512)
+def _desc_keywords(desc: str) -> tuple[bool, bool, bool]:
+    """(có 'mưa', có 'nắng', có 'mây') trong mô tả — tập mô tả rất nhỏ nên cache theo chuỗi."""
+    d = desc.lower()
+    return "mưa" in d, "nắng" in d, "mây" in d
+
+NO_KEYWORDS = (False, False, False)
+
+def _desc_flags(descs: list) -> np.ndarray:
+    """Cờ (mưa, nắng, mây) cho cả cột mô tả → mảng bool (n, 3), tính một lần rồi dùng cho icon và nhận định."""
+    return np.array([_desc_keywords(d) if d else NO_KEYWORDS for d in descs], dtype=bool).reshape(-1, 3)
+
+
 def generate_comment(desc: str, temp: float | None = None, rain: float | None = None, wind: float | None = None) -> str:
     """
     Sinh nhận định tự động dựa trên mô tả, nhiệt độ, mưa, gió.
     Dùng chung cho tất cả phần bản tin.
     """
-    d = desc.lower() if desc else ""
+    return _comment(_desc_keywords(desc) if desc else NO_KEYWORDS, temp, rain, wind)
+
+def _comment(flags, temp=None, rain=None, wind=None) -> str:
+    """Thân của generate_comment khi đã có sẵn cờ (mưa, nắng, mây) của mô tả."""
+    has_rain, has_sun, has_cloud = flags
 
-    if "mưa" in d or (rain and rain > 5):
+    if has_rain or (rain and rain > 5):
         return "💡 Nhận định: Trời có mưa, nên mang theo áo mưa."
-    if "nắng" in d or (temp and temp >= 33):
+    if has_sun or (temp and temp >= 33):
         return "💡 Nhận định: Nắng nóng, chú ý chống nắng khi ra ngoài."
-    if "mây" in d and (rain is None or rain == 0):
+    if has_cloud and (rain is None or rain == 0):
         return "💡 Nhận định: Nhiều mây, thời tiết ôn hòa."
     if wind and wind >= 10:
         return "💡 Nhận định: Gió mạnh, hạn chế hoạt động ngoài trời."
@@ -39,6 +94,106 @@ def generate_comment(desc: str, temp: float | None = None, rain: float | None =
         return "💡 Nhận định: Trời lạnh, nên giữ ấm khi ra ngoài."
     return "💡 Nhận định: Thời tiết ôn hòa, thuận lợi cho sinh hoạt."
 
+def _weather_icons(kw: np.ndarray, temps: list, winds: list) -> list[str]:
+    """
+    Chọn icon cho cả cột bằng np.select trên các mask (mưa/nắng/mây → gió ≥ 8 → nóng ≥ 33 → lạnh ≤ 15).
+    kw là mảng cờ từ _desc_flags; temps/winds đã qua _num (None → NaN, không thỏa điều kiện nào).
+    """
+    t = np.array(temps, dtype=float)
+    w = np.array(winds, dtype=float)
+    conds = [kw[:, 0], kw[:, 1], kw[:, 2], w >= 8, t >= 33, t <= 15]
+    return np.select(conds, WEATHER_ICONS, default="🌤️").tolist()
+
+def _streak_alerts(mask: np.ndarray, day: np.ndarray, day_txts: list, label: str, icon: str) -> list[str]:
+    """
+    Cảnh báo chuỗi ngày liên tiếp thỏa điều kiện (mask theo từng dòng, day là số ngày lịch).
+    - Chuỗi bị ngắt khi điều kiện sai hoặc hai dòng không cách nhau đúng 1 ngày
+    - Từ ngày thứ 3 của chuỗi, mỗi ngày sinh một dòng; dòng cuối chuỗi thêm ", sau đó giảm"
+      nếu dòng kế tiếp không còn thỏa điều kiện
+    """
+    n = len(mask)
+    link = np.zeros(n, dtype=bool)
+    link[1:] = mask[1:] & mask[:-1] & (np.diff(day) == 1)
+    starts = np.flatnonzero(mask & ~link)
+    ends = np.flatnonzero(mask & ~np.append(link[1:], False))
+
+    msgs = []
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        for k in range(s + 2, e + 1):
+            msg = f"🚨 {icon} {label} liên tục {k - s + 1} ngày ({day_txts[s]} → {day_txts[k]})"
+            if k == e and e + 1 < n and not mask[e + 1]:
+                msg += ", sau đó giảm"
+            msgs.append(msg)
+    return msgs
+
+def _pick_header_icon(kind: str, flags, temp: float | None = None, wind: float | None = None) -> str:
+    """Icon tiêu đề cho khối `kind` (xem HEADER_ICON_RULES) từ cờ mô tả và nhiệt độ/gió đã qua _num."""
+    has_rain, has_sun, has_cloud = flags
+    conds = {
+        "rain": has_rain,
+        "sun": has_sun,
+        "cloud": has_cloud,
+        "cold": temp is not None and temp <= 15,
+        "hot": temp is not None and temp >= 33,
+        "windy": wind is not None and wind > 8,
+    }
+    for name, icon in HEADER_ICON_RULES[kind]:
+        if conds[name]:
+            return icon
+    return "🌤️"
+
+def _overview_level(total_rain, max_wind, avg_temp) -> tuple[str, str]:
+    """Chọn (icon, mô tả) cho phần tổng quan trong ngày từ bảng OVERVIEW_LEVELS."""
+    has_temp = avg_temp != "-"
+    if total_rain >= 20:
+        level = 0
+    elif total_rain > 0:
+        level = 1
+    elif max_wind >= 10:
+        level = 2
+    elif has_temp and avg_temp >= 33:
+        level = 3
+    elif has_temp and avg_temp <= 15:
+        level = 4
+    else:
+        level = 5
+    return OVERVIEW_LEVELS[level]
+
+# ===== CACHE =====
+
+def _frame_key(df):
+    """
+    Vân tay DataFrame: số dòng + blake2b trên tên/kiểu từng cột và bytes thô của mảng giá trị.
+    - Cột số/datetime: băm thẳng buffer NumPy (datetime có múi giờ dùng epoch i8)
+    - Cột object/category (mô tả, nguồn): băm repr của list giá trị — vài chục phần tử
+    """
+    if not isinstance(df, pd.DataFrame):
+        return None
+    h = hashlib.blake2b(digest_size=8)
+    for name, col in df.items():
+        h.update(f"{name}:{col.dtype}".encode())
+        if isinstance(col.dtype, pd.DatetimeTZDtype):
+            h.update(col.array.asi8.tobytes())
+            continue
+        values = col.to_numpy()
+        if values.dtype.kind in "biufcmM":
+            h.update(np.ascontiguousarray(values).tobytes())
+        else:
+            h.update(repr(values.tolist()).encode())
+    return len(df), h.digest()
+
+def _bulletin_key(now_local, region_name, hourly_df, daily_df, current, source, group_hours):
+    """
+    Khóa cache của bản tin; None nếu đầu vào không băm được (khi đó không cache).
+    Gồm cả ngày + phút địa phương: bản tin in giờ cập nhật và lọc "hôm nay" theo đồng hồ.
+    """
+    try:
+        current_key = repr(sorted(current.items())) if isinstance(current, dict) else repr(current)
+        return (now_local.strftime("%Y%m%d%H%M"), region_name, _frame_key(hourly_df), _frame_key(daily_df),
+                current_key, source, group_hours)
+    except Exception:
+        return None
+
 # ===== HÀM CHÍNH =====
 
 def generate_bulletin(
@@ -49,7 +204,27 @@ def generate_bulletin(
     source: str = "weatherapi",
     group_hours: bool = False
 ) -> dict:
+    """Bản tin cho khu vực; dùng lại kết quả trong cùng phút nếu đầu vào không đổi (updated_at luôn là lúc gọi)."""
     now_local = datetime.now(ICT)
+    key = _bulletin_key(now_local, region_name, hourly_df, daily_df, current, source, group_hours)
+    result = _BULLETIN_CACHE.get(key) if key is not None else None
+    if result is None:
+        result = _build_bulletin(region_name, hourly_df, daily_df, current, source, group_hours, now_local)
+        if key is not None:
+            _BULLETIN_CACHE.set(key, result)
+    return {**result, "updated_at": now_local.isoformat()}
+
+
+def _build_bulletin(
+    region_name: str,
+    hourly_df: pd.DataFrame,
+    daily_df: pd.DataFrame,
+    current: dict | None = None,
+    source: str = "weatherapi",
+    group_hours: bool = False,
+    now_local: datetime | None = None
+) -> dict:
+    now_local = datetime.now(ICT) if now_local is None else now_local
     today = now_local.date()
     bulletin = []
 
@@ -60,28 +235,21 @@ def generate_bulletin(
 
     # lấy mô tả và nhiệt độ hiện tại để chọn icon
     desc = current.get("weather_desc", "") if isinstance(current, dict) else ""
-    temp_val = current.get("temp") if isinstance(current, dict) else None
-
-    if desc and "mưa" in desc.lower():
-        header_icon = "🌧️"
-    elif desc and "nắng" in desc.lower():
-        header_icon = "☀️"
-    elif desc and "mây" in desc.lower():
-        header_icon = "☁️"
-    elif isinstance(temp_val, (int, float)) and temp_val <= 15:
-        header_icon = "❄️"
-    elif isinstance(temp_val, (int, float)) and temp_val >= 33:
-        header_icon = "🔥"
-    else:
-        header_icon = "🌤️"
-
-    bulletin.append(f"{header_icon}✨ BẢN TIN DỰ BÁO THỜI TIẾT — {region_name}")
-    bulletin.append(f"📅 Ngày: {today.strftime('%d/%m/%Y')}")
-    bulletin.append(f"🕒 Cập nhật lúc: {now_local.strftime('%H:%M %Z')}")
-    bulletin.append(f"📡 Nguồn dữ liệu: {src_name}")
-    bulletin.append("🌍 Phạm vi: Khu vực địa phương và lân cận")
-    bulletin.append("🔔 Thông tin: Nhiệt độ, mưa, gió, độ ẩm, cảnh báo")
-    bulletin.append("💡 Lưu ý: Dữ liệu có thể thay đổi theo thời gian\n")
+    cur_temp = _num(current.get("temp")) if isinstance(current, dict) else None
+
+    # cờ mưa/nắng/mây của mô tả hiện tại, dùng chung cho tiêu đề và phần HIỆN TẠI
+    cur_flags = _desc_keywords(desc) if desc else NO_KEYWORDS
+    header_icon = _pick_header_icon("title", cur_flags, temp=cur_temp)
+
+    bulletin.append(
+        f"{header_icon}✨ BẢN TIN DỰ BÁO THỜI TIẾT — {region_name}\n"
+        f"📅 Ngày: {today.strftime('%d/%m/%Y')}\n"
+        f"🕒 Cập nhật lúc: {now_local.strftime('%H:%M %Z')}\n"
+        f"📡 Nguồn dữ liệu: {src_name}\n"
+        "🌍 Phạm vi: Khu vực địa phương và lân cận\n"
+        "🔔 Thông tin: Nhiệt độ, mưa, gió, độ ẩm, cảnh báo\n"
+        "💡 Lưu ý: Dữ liệu có thể thay đổi theo thời gian\n"
+    )
 
     # ===== HIỆN TẠI =====
     if isinstance(current, dict):
@@ -94,23 +262,14 @@ def generate_bulletin(
         rain_val = current.get("rain", 0.0)
         wind_val = current.get("wind_speed", 0.0)
 
-        temp_txt = f"{float(temp_raw):.1f}" if isinstance(temp_raw, (int, float)) else "-"
-        hum_txt = f"{int(hum_raw)}" if isinstance(hum_raw, (int, float)) else "-"
-        wind_txt = f"{float(wind_raw):.1f}" if isinstance(wind_raw, (int, float)) else "-"
+        temp_num, hum_num, wind_num = _num(temp_raw), _num(hum_raw), _num(wind_raw)
 
-        # Chọn icon tiêu đề theo điều kiện
-        if "mưa" in desc.lower():
-            header_icon = "🌦️"
-        elif "nắng" in desc.lower():
-            header_icon = "☀️"
-        elif "mây" in desc.lower():
-            header_icon = "☁️"
-        elif isinstance(wind_raw, (int, float)) and wind_raw > 8:
-            header_icon = "💨"
-        else:
-            header_icon = "🌤️"
+        temp_txt = f"{temp_num:.1f}" if temp_num is not None else "-"
+        hum_txt = f"{int(hum_num)}" if hum_num is not None else "-"
+        wind_txt = f"{wind_num:.1f}" if wind_num is not None else "-"
 
-        bulletin.append(f"{header_icon} HIỆN TẠI")
+        # Chọn icon tiêu đề theo điều kiện
+        header_icon = _pick_header_icon("current", cur_flags, wind=wind_num)
 
         # Dòng chi tiết với nhiều biểu tượng khác nhau
         line = (
@@ -124,9 +283,12 @@ def generate_bulletin(
         if vis is not None:
             line += f", 🌫️ Tầm nhìn {vis} km"
 
-        # Nhận định tự động (dùng temp_raw thay cho temp_val)
-        bulletin.append(generate_comment(desc, temp_raw, rain_val, wind_val))
-        bulletin.append(line + "\n")
+        # Tiêu đề, nhận định tự động (dùng temp_raw thay cho temp_val) và dòng chi tiết
+        bulletin.extend((
+            f"{header_icon} HIỆN TẠI",
+            _comment(cur_flags, temp_raw, rain_val, wind_val),
+            line + "\n",
+        ))
         
     # ===== TỔNG QUAN TRONG NGÀY =====
     total_rain = 0.0
@@ -137,187 +299,172 @@ def generate_bulletin(
     desc_day = ""   # <-- khai báo trước để tránh NameError
 
     if isinstance(hourly_df, pd.DataFrame) and not hourly_df.empty:
-        dfh = hourly_df.copy()
-        if "ts" in dfh.columns:
-            dfh["ts"] = pd.to_datetime(dfh["ts"], errors="coerce", utc=True)
-            dfh["ts_local"] = dfh["ts"].dt.tz_convert(ICT)
-        today_df = dfh[dfh["ts_local"].dt.date == today] if "ts_local" in dfh else dfh
-
-        avg_temp = round(today_df["temp"].mean(), 1) if "temp" in today_df else "-"
-        min_temp = round(today_df["temp"].min(), 1) if "temp" in today_df else "-"
-        max_temp = round(today_df["temp"].max(), 1) if "temp" in today_df else "-"
-        total_rain = round(today_df["rain"].sum(), 1) if "rain" in today_df else 0.0
-        max_wind = round(today_df["wind_speed"].max(), 1) if "wind_speed" in today_df else 0.0
-
-        # mô tả tổng quan trong ngày (fallback nếu không có cột weather_desc)
-        if "weather_desc" in today_df:
-            desc_day = str(today_df["weather_desc"].mode()[0])  # lấy mô tả phổ biến nhất
+        # Lọc theo ngày địa phương: so sánh ts (UTC) với mốc đầu/cuối ngày hôm nay đổi sẵn sang UTC
+        if "ts" in hourly_df.columns:
+            day_start = pd.Timestamp(now_local).normalize().tz_convert("UTC")
+            ts = ensure_ts(hourly_df["ts"])
+            today_df = hourly_df[((ts >= day_start) & (ts < day_start + pd.Timedelta(days=1))).to_numpy()]
+        elif "ts_local" in hourly_df:
+            today_df = hourly_df[hourly_df["ts_local"].dt.date == today]
         else:
-            if total_rain >= 20:
-                desc_day = "Mưa lớn"
-            elif total_rain > 0:
-                desc_day = "Có mưa"
-            elif max_wind >= 10:
-                desc_day = "Gió mạnh"
-            elif avg_temp != "-" and avg_temp >= 33:
-                desc_day = "Nắng nóng"
-            elif avg_temp != "-" and avg_temp <= 15:
-                desc_day = "Trời lạnh"
-            else:
-                desc_day = "Thời tiết ôn hòa"
-
-        # Chọn icon tiêu đề theo điều kiện tổng quan
-        if total_rain >= 20:
-            header_icon = "⛈️"   # mưa lớn
-        elif total_rain > 0:
-            header_icon = "🌧️"   # có mưa
-        elif max_wind >= 10:
-            header_icon = "💨"   # gió mạnh
-        elif avg_temp != "-" and avg_temp >= 33:
-            header_icon = "🔥"   # nắng nóng
-        elif avg_temp != "-" and avg_temp <= 15:
-            header_icon = "❄️"   # trời lạnh
+            today_df = hourly_df
+
+        # Thống kê trong ngày bằng một lần agg cho các cột có mặt
+        aggs = {
+            col: funcs
+            for col, funcs in (("temp", ["mean", "min", "max"]), ("rain", ["sum"]), ("wind_speed", ["max"]))
+            if col in today_df
+        }
+        stats = today_df.agg(aggs) if aggs else None
+
+        def stat(col, func, default):
+            return round(stats.at[func, col], 1) if col in aggs else default
+
+        avg_temp = stat("temp", "mean", "-")
+        min_temp = stat("temp", "min", "-")
+        max_temp = stat("temp", "max", "-")
+        total_rain = stat("rain", "sum", 0.0)
+        max_wind = stat("wind_speed", "max", 0.0)
+
+        # Icon tiêu đề và mô tả fallback dùng chung một lần xét điều kiện
+        header_icon, overview_desc = _overview_level(total_rain, max_wind, avg_temp)
+
+        # mô tả tổng quan trong ngày: mô tả phổ biến nhất (np.unique đã sắp xếp → hòa thì lấy
+        # giá trị nhỏ nhất như mode()[0]); fallback nếu không có cột/giá trị weather_desc
+        descs_today = today_df["weather_desc"].dropna().to_numpy() if "weather_desc" in today_df else []
+        if len(descs_today):
+            uniq, counts = np.unique(descs_today, return_counts=True)
+            desc_day = str(uniq[counts.argmax()])
         else:
-            header_icon = "🌤️"   # thời tiết ôn hòa
+            desc_day = overview_desc
 
-        bulletin.append(f"{header_icon} TỔNG QUAN TRONG NGÀY")
-        bulletin.append(f"🌡️ Trung bình: {avg_temp}°C (dao động {min_temp}–{max_temp}°C)")
-        bulletin.append(f"🌧️ Tổng mưa: {total_rain} mm")
-        bulletin.append(f"💨 Gió mạnh nhất: {max_wind} m/s\n")
+        bulletin.append(
+            f"{header_icon} TỔNG QUAN TRONG NGÀY\n"
+            f"🌡️ Trung bình: {avg_temp}°C (dao động {min_temp}–{max_temp}°C)\n"
+            f"🌧️ Tổng mưa: {total_rain} mm\n"
+            f"💨 Gió mạnh nhất: {max_wind} m/s\n"
+        )
 
     # Nhận định tự động (luôn có desc_day)
-    bulletin.append(generate_comment(desc_day, avg_temp, total_rain, max_wind))
-    bulletin.append("")
+    bulletin.extend((generate_comment(desc_day, avg_temp, total_rain, max_wind), ""))
 
     # ===== DỰ BÁO THEO GIỜ (24h) =====
-    def choose_weather_icon(desc: str, temp: float | None = None, wind: float | None = None) -> str:
-        """Chọn icon phù hợp dựa trên mô tả, nhiệt độ và gió."""
-        d = desc.lower()
-        if "mưa" in d:
-            return "🌦️"
-        if "nắng" in d:
-            return "☀️"
-        if "mây" in d:
-            return "☁️"
-        if isinstance(wind, (int, float)) and wind >= 8:
-            return "💨"
-        if isinstance(temp, (int, float)):
-            if temp >= 33:
-                return "🔥"
-            elif temp <= 15:
-                return "❄️"
-        return "🌤️"
-
     if isinstance(hourly_df, pd.DataFrame) and not hourly_df.empty:
-        bulletin.append("🕑 DỰ BÁO THEO GIỜ (24h)")
-        for _, row in hourly_df.head(24).iterrows():
-            ts = row["ts"].strftime("%H:%M") if pd.notnull(row["ts"]) else "-"
-            temp_val = row.get("temp")
-            temp_txt = f"{temp_val:.1f}" if isinstance(temp_val, (int, float)) else "-"
-            desc = row.get("weather_desc", "Không rõ")
-            rain_val = round(row.get("rain", 0.0) or 0.0, 1)
-            wind_val = round(row.get("wind_speed", 0.0) or 0.0, 1)
-            hum = row.get("humidity")
-            hum_txt = f"{int(hum)}%" if isinstance(hum, (int, float)) else "-"
-
-            # chọn icon tự động
-            icon = choose_weather_icon(desc, temp_val, wind_val)
+        h24 = hourly_df.head(24)
+
+        # Định dạng giờ cho cả cột một lần (cột datetime); kiểu khác thì định dạng từng phần tử
+        if pd.api.types.is_datetime64_any_dtype(h24["ts"]):
+            ts_txts = h24["ts"].dt.strftime("%H:%M").fillna("-").tolist()
+        else:
+            ts_txts = [v.strftime("%H:%M") if pd.notnull(v) else "-" for v in h24["ts"].tolist()]
+
+        temps = [_num(v) for v in _col_values(h24, "temp")]
+        hums = [_num(v) for v in _col_values(h24, "humidity")]
+        descs = _col_values(h24, "weather_desc", "Không rõ")
+        rain_vals = [round(v or 0.0, 1) for v in _col_values(h24, "rain", 0.0)]
+        wind_vals = [round(v or 0.0, 1) for v in _col_values(h24, "wind_speed", 0.0)]
+
+        # cờ mô tả và icon tự động cho cả 24 giờ một lần
+        kw = _desc_flags(descs)
+        icons = _weather_icons(kw, temps, wind_vals)
+
+        # gom các dòng của 24 giờ rồi extend một lần
+        lines = ["🕑 DỰ BÁO THEO GIỜ (24h)"]
+        add = lines.append
+        for ts, icon, flags, temp_val, desc, rain_val, wind_val, hum in zip(
+            ts_txts, icons, kw.tolist(), temps, descs, rain_vals, wind_vals, hums
+        ):
+            temp_txt = f"{temp_val:.1f}" if temp_val is not None else "-"
+            hum_txt = f"{int(hum)}%" if hum is not None else "-"
 
             # dòng chi tiết
-            line = (
+            add(
                 f"{ts} → {icon} {temp_txt}°C | {desc} | "
                 f"🌧️ {rain_val} mm | 💨 {wind_val} m/s | 💧 {hum_txt}"
             )
-            bulletin.append(line)
 
             # nhận định tự động cho từng giờ
-            bulletin.append(generate_comment(desc, temp_val, rain_val, wind_val))
+            add(_comment(flags, temp_val, rain_val, wind_val))
 
-        bulletin.append("")
+        add("")
+        bulletin.extend(lines)
 
     # ===== XU HƯỚNG 10 NGÀY =====
     bulletin.append("📅 XU HƯỚNG 10 NGÀY TỚI")
-    if isinstance(daily_df, pd.DataFrame) and not daily_df.empty:
-        dfd = daily_df.copy()
-        dfd["ts"] = pd.to_datetime(dfd["ts"], errors="coerce", utc=True)
-        dfd["ts_local"] = dfd["ts"].dt.tz_convert(ICT)
-        dfd = dfd.dropna(subset=["ts_local"]).sort_values("ts_local").head(10)
-
-        for _, row in dfd.iterrows():
-            date_txt = row["ts_local"].strftime("%d/%m")
-
-            # lấy nhiệt độ với fallback avg
-            tmin_val = row.get("temp_min")
-            tmax_val = row.get("temp_max")
-            tavg_val = row.get("temp_avg")
-            if tmin_val is None and isinstance(tavg_val, (int, float)):
+    dfd = None   # 10 ngày đã sắp xếp; None nếu không có dữ liệu dùng được
+    if isinstance(daily_df, pd.DataFrame) and not daily_df.empty and "ts" in daily_df.columns:
+        # Sắp xếp/cắt trên cột thời gian rồi mới lấy 10 dòng (chỉ copy phần cần dùng)
+        ts = ensure_ts(daily_df["ts"])
+        ts_local = ts.dt.tz_convert(ICT)
+        order = ts_local.reset_index(drop=True).dropna().sort_values().index[:10]
+        dfd = daily_df.iloc[order].copy()
+        dfd["ts"] = ts.iloc[order].array
+        dfd["ts_local"] = ts_local.iloc[order].array
+
+        # Chuỗi ngày cho cả cột trong một lần gọi dt.strftime
+        date_txts = dfd["ts_local"].dt.strftime("%d/%m")
+        days = []
+        for date_txt, tmin_val, tmax_val, tavg_val, rain_raw, wind_raw, hum_val, desc_day in zip(
+            date_txts,
+            map(_num, _col_values(dfd, "temp_min")),
+            map(_num, _col_values(dfd, "temp_max")),
+            map(_num, _col_values(dfd, "temp_avg")),
+            _col_values(dfd, "rain", 0.0),
+            _col_values(dfd, "wind_speed", 0.0),
+            map(_num, _col_values(dfd, "humidity")),
+            _col_values(dfd, "weather_desc", "Không rõ"),
+        ):
+            # lấy nhiệt độ với fallback avg (thiếu = None sau _num, kể cả NaN)
+            if tmin_val is None:
                 tmin_val = tavg_val
-            if tmax_val is None and isinstance(tavg_val, (int, float)):
-               tmax_val = tavg_val
+            if tmax_val is None:
+                tmax_val = tavg_val
 
-            if isinstance(tmin_val, (int, float)) and isinstance(tmax_val, (int, float)) and tmin_val == tmax_val:
-                temp_txt = f"{float(tmin_val):.1f}°C"
+            if tmin_val is not None and tmin_val == tmax_val:
+                temp_txt = f"{tmin_val:.1f}°C"
                 avg_temp = tmin_val
             else:
-                tmin_txt = f"{float(tmin_val):.1f}" if isinstance(tmin_val, (int, float)) else "-"
-                tmax_txt = f"{float(tmax_val):.1f}" if isinstance(tmax_val, (int, float)) else "-"
+                tmin_txt = f"{tmin_val:.1f}" if tmin_val is not None else "-"
+                tmax_txt = f"{tmax_val:.1f}" if tmax_val is not None else "-"
                 temp_txt = f"{tmin_txt}–{tmax_txt}°C"
-                avg_temp = (tmin_val + tmax_val) / 2 if isinstance(tmin_val, (int, float)) and isinstance(tmax_val, (int, float)) else None
-
-            rain_val = round(row.get("rain", 0.0) or 0.0, 1)
-            wind_val = round(row.get("wind_speed", 0.0) or 0.0, 1)
-            hum_val = row.get("humidity")
-            hum_txt = f"{int(hum_val)}%" if isinstance(hum_val, (int, float)) else "-"
-            desc_day = row.get("weather_desc", "Không rõ")
+                avg_temp = (tmin_val + tmax_val) / 2 if tmin_val is not None and tmax_val is not None else None
 
-            # chọn icon tự động
-            icon = choose_weather_icon(desc_day, avg_temp, wind_val)
+            rain_val = round(rain_raw or 0.0, 1)
+            wind_val = round(wind_raw or 0.0, 1)
+            hum_txt = f"{int(hum_val)}%" if hum_val is not None else "-"
+            days.append((date_txt, temp_txt, avg_temp, rain_val, wind_val, hum_txt, desc_day))
 
-            # dòng chi tiết
-            bulletin.append(f"{icon} {date_txt} → 🌡️ {temp_txt} | 🌧️ {rain_val} mm | 💨 {wind_val} m/s | 💧 {hum_txt}")
+        # cờ mô tả và icon tự động cho cả 10 ngày một lần
+        kw = _desc_flags([d[6] for d in days])
+        icons = _weather_icons(kw, [d[2] for d in days], [d[4] for d in days])
 
-            # nhận định tự động cho từng ngày
-            bulletin.append(generate_comment(desc_day, avg_temp, rain_val, wind_val))
-            bulletin.append("")
+        for icon, flags, (date_txt, temp_txt, avg_temp, rain_val, wind_val, hum_txt, desc_day) in zip(icons, kw.tolist(), days):
+            # dòng chi tiết, nhận định tự động cho từng ngày và dòng trống
+            bulletin.extend((
+                f"{icon} {date_txt} → 🌡️ {temp_txt} | 🌧️ {rain_val} mm | 💨 {wind_val} m/s | 💧 {hum_txt}",
+                _comment(flags, avg_temp, rain_val, wind_val),
+                "",
+            ))
 
     # =========================
     # TỔNG CẢNH BÁO
     # =========================
     bulletin.append("🚨 CẢNH BÁO")
 
-    if 'dfd' in locals() and isinstance(dfd, pd.DataFrame) and not dfd.empty:
-        def detect_streak_with_decline(df, col, condition, label, icon):
-            streak = 0
-            start_date = None
-            prev_date = None
-            for i, row in enumerate(df.itertuples()):
-                date = row.ts_local.date()
-                val = getattr(row, col, None)
-                if condition(val):
-                    if streak == 0:
-                        start_date = date
-                    if prev_date and (date - prev_date).days == 1:
-                        streak += 1
-                    else:
-                        streak = 1
-                        start_date = date
-                    prev_date = date
-                    if streak >= 3:
-                        msg = f"🚨 {icon} {label} liên tục {streak} ngày ({start_date.strftime('%d/%m')} → {date.strftime('%d/%m')})"
-                        if i + 1 < len(df):
-                            next_val = getattr(df.iloc[i+1], col, None)
-                            if not condition(next_val):
-                                msg += ", sau đó giảm"
-                        bulletin.append(msg)
-                else:
-                    streak = 0
-                    start_date = None
-                    prev_date = None
-
-        detect_streak_with_decline(dfd, "rain", lambda v: isinstance(v, (int, float)) and v >= 5, "Mưa", "🌧️")
-        detect_streak_with_decline(dfd, "temp_max", lambda v: isinstance(v, (int, float)) and v >= HEAT_ALERT, "Nắng nóng", "🔥")
-        detect_streak_with_decline(dfd, "wind_speed", lambda v: isinstance(v, (int, float)) and v >= WIND_DAILY_ALERT, "Gió mạnh", "💨")
-        detect_streak_with_decline(dfd, "temp_min", lambda v: isinstance(v, (int, float)) and v <= COLD_ALERT, "Trời lạnh", "❄️")
+    if dfd is not None and not dfd.empty:
+        # Số ngày lịch (giờ địa phương) và nhãn dd/mm cho từng dòng, dùng chung cho mọi chuỗi
+        day = dfd["ts_local"].dt.tz_localize(None).to_numpy().astype("datetime64[D]").astype(np.int64)
+        day_txts = dfd["ts_local"].dt.strftime("%d/%m").tolist()
+
+        def num(col):
+            if col not in dfd.columns:
+                return np.full(len(dfd), np.nan)
+            return pd.to_numeric(dfd[col], errors="coerce").to_numpy(dtype=float)
+
+        bulletin.extend(_streak_alerts(num("rain") >= 5, day, day_txts, "Mưa", "🌧️"))
+        bulletin.extend(_streak_alerts(num("temp_max") >= HEAT_ALERT, day, day_txts, "Nắng nóng", "🔥"))
+        bulletin.extend(_streak_alerts(num("wind_speed") >= WIND_DAILY_ALERT, day, day_txts, "Gió mạnh", "💨"))
+        bulletin.extend(_streak_alerts(num("temp_min") <= COLD_ALERT, day, day_txts, "Trời lạnh", "❄️"))
     else:
         bulletin.append("⚠️ Không có dữ liệu dự báo 10 ngày.")
 
@@ -327,25 +474,22 @@ def generate_bulletin(
         alerts.append("🌧️ Mưa lớn trong ngày, nguy cơ ngập úng.")
     if max_wind > WIND_DAILY_ALERT:
         alerts.append("💨 Gió mạnh, cần chú ý an toàn.")
-    if isinstance(current, dict):
-        if isinstance(current.get("temp"), (int, float)):
-            if current["temp"] >= HEAT_ALERT:
-                alerts.append("🔥 Nắng nóng gay gắt.")
-            if current["temp"] <= COLD_ALERT:
-                alerts.append("❄️ Trời lạnh, cần giữ ấm.")
+    if cur_temp is not None:
+        if cur_temp >= HEAT_ALERT:
+            alerts.append("🔥 Nắng nóng gay gắt.")
+        if cur_temp <= COLD_ALERT:
+            alerts.append("❄️ Trời lạnh, cần giữ ấm.")
     if not alerts:
         alerts.append("✅ Không có cảnh báo đáng lo ngại.")
     bulletin.extend(alerts)
 
     # ===== CẢNH BÁO BÃO =====
     storm_msg = check_storm_alert(current or {}, daily_df)
-    bulletin.append("\n⛈️ CẢNH BÁO BÃO")
-    bulletin.append(storm_msg)
+    bulletin.extend(("\n⛈️ CẢNH BÁO BÃO", storm_msg))
 
     # ===== CẢNH BÁO HIỆN TƯỢNG BẤT THƯỜNG =====
     unusual_msg = check_unusual_alert(current or {}, hourly_df, daily_df)
-    bulletin.append("\n⚠️ CẢNH BÁO HIỆN TƯỢNG BẤT THƯỜNG")
-    bulletin.append(unusual_msg)
+    bulletin.extend(("\n⚠️ CẢNH BÁO HIỆN TƯỢNG BẤT THƯỜNG", unusual_msg))
   
     # ===== KẾT LUẬN =====
     bulletin.append("\n👉 Kết luận: Chủ động theo dõi và chuẩn bị để thích ứng với mọi biến động thời tiết.")
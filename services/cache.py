@@ -0,0 +1,51 @@
+# services/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# TTL dữ liệu thời tiết theo loại fetch (giây): số liệu hiện tại đổi nhanh hơn dự báo nên TTL ngắn hơn.
+# Cache fetch (api/app_utils, services/etl) là tầng duy nhất quyết định độ mới và dữ liệu dự phòng.
+FETCH_TTL = {"current": 60, "forecast": 600}
+
+
+class TTLCache:
+    """
+    Cache trong tiến trình có thời hạn (TTL), an toàn đa luồng.
+    - ttl: số giây một bản ghi còn hiệu lực (mặc định; set() có thể ghi đè theo từng bản ghi)
+    - maxsize: số bản ghi tối đa, vượt quá thì bỏ bản ghi cũ nhất
+    Bản ghi hết hạn không bị xóa ngay: get() bỏ qua nhưng get_stale() vẫn đọc được
+    (dùng làm dự phòng khi nguồn lỗi), cho tới khi bị đẩy ra bởi maxsize.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                return default
+            return value
+
+    def get_stale(self, key, default=None):
+        """Giá trị đã lưu của key kể cả khi đã hết hạn."""
+        with self._lock:
+            item = self._data.get(key)
+            return default if item is None else item[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
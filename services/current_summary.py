@@ -1,10 +1,34 @@
 # services/current_summary.py
+import numpy as np
 import pandas as pd
+from bisect import bisect_right
 from datetime import datetime, timezone, timedelta
 
 # Múi giờ Việt Nam (ICT = UTC+7)
 ICT = timezone(timedelta(hours=7))
 
+# Ngưỡng phân loại (mm, °C): bisect_right trên ngưỡng → chỉ số mức trong bảng
+RAIN_BINS = (1, 5, 20)
+RAIN_LEVELS = (
+    ("🌦️", "Mưa rất nhẹ"),
+    ("🌧️", "Mưa nhẹ"),
+    ("🌧️", "Mưa vừa"),
+    ("⛈️", "Mưa to"),
+)
+TEMP_BINS = (23, 28, 33)
+TEMP_LEVELS = (
+    ("☀️", "Trời quang mát"),
+    ("🌤️", "Nắng nhẹ"),
+    ("☀️", "Nắng mạnh"),
+    ("🔥", "Nắng nóng gay gắt"),
+)
+
+# Key lượng mưa theo thứ tự ưu tiên: schema chuẩn hóa, rồi tên gốc của Open-Meteo / WeatherAPI
+RAIN_KEYS = ("rain", "precipitation", "precip_mm")
+
+# Bản ghi giờ chỉ dùng thay current nếu lệch thời điểm hiện tại không quá 1 giờ
+RAIN_NEAREST_MAX_S = 3600
+
 def generate_current_summary(current: dict, hourly_df: pd.DataFrame) -> str:
     """
     Sinh phần bản tin 'HIỆN TẠI' riêng biệt.
@@ -31,6 +55,67 @@ def generate_current_summary(current: dict, hourly_df: pd.DataFrame) -> str:
     return text
 
 
+def _safe_float(val, default=0.0):
+    """Ép kiểu float an toàn, fallback về default nếu lỗi."""
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+
+def _coerce_rain(val) -> float | None:
+    """Số mưa (mm) từ một giá trị: số/chuỗi số hoặc dict kiểu OWM {"1h": ...} / {"3h": ...}; NaN/lỗi → None."""
+    if isinstance(val, dict):
+        val = val.get("1h", val.get("3h"))
+    val = _safe_float(val, None)
+    return None if val is None or val != val else val
+
+
+def extract_rain(record: dict) -> float | None:
+    """Lượng mưa (mm) của một bản ghi: key đầu tiên trong RAIN_KEYS có giá trị hợp lệ."""
+    if not isinstance(record, dict):
+        return None
+    for key in RAIN_KEYS:
+        val = _coerce_rain(record.get(key))
+        if val is not None:
+            return val
+    return None
+
+
+def get_rain_value(current: dict, hourly_df: pd.DataFrame) -> float | None:
+    """
+    Lượng mưa hiện tại: ưu tiên current, không có thì lấy bản ghi giờ gần thời điểm hiện tại nhất
+    (lệch tối đa RAIN_NEAREST_MAX_S giây). Tìm bằng argmin trên mảng ns, không copy/sort DataFrame.
+    """
+    rain = extract_rain(current or {})
+    if rain is not None or not isinstance(hourly_df, pd.DataFrame) or hourly_df.empty:
+        return rain
+
+    if "dt" in hourly_df.columns:
+        ts = pd.to_datetime(hourly_df["dt"], unit="s", utc=True, errors="coerce")
+    elif "ts" in hourly_df.columns:
+        ts = pd.to_datetime(hourly_df["ts"], utc=True, errors="coerce")
+    else:
+        return None
+
+    ts_ns = ts.to_numpy("datetime64[ns]")
+    valid = ~np.isnat(ts_ns)
+    if not valid.any():
+        return None
+    now_ns = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "ns").astype(np.int64)
+    delta = np.where(valid, np.abs(ts_ns.view(np.int64) - now_ns), np.iinfo(np.int64).max)
+    i = int(delta.argmin())
+    if delta[i] > RAIN_NEAREST_MAX_S * 1_000_000_000:
+        return None
+    return extract_rain(hourly_df.iloc[i].to_dict())
+
+
+def format_rain_value(rain_val: float | None) -> str:
+    """Chuỗi hiển thị lượng mưa; không có số liệu → "-"."""
+    rv = _safe_float(rain_val, None)
+    return "-" if rv is None or rv != rv else f"{rv:.1f} mm"
+
+
 def summarize_current(current: dict, rain_val: float | None) -> dict:
     """
     Tóm tắt điều kiện hiện tại với icon + mô tả.
@@ -38,44 +123,24 @@ def summarize_current(current: dict, rain_val: float | None) -> dict:
     - rain_val: lượng mưa (mm) từ current hoặc hourly
     """
 
-    def safe_float(val, default=0.0):
-        """Ép kiểu float an toàn, fallback về default nếu lỗi."""
-        try:
-            return float(val)
-        except (TypeError, ValueError):
-            return default
-
-    wind_now = safe_float(current.get("wind_speed"), 0.0)
-    clouds_now = safe_float(current.get("clouds"), 0.0)
-    temp_now = safe_float(current.get("temp"), 0.0)
+    wind_now = _safe_float(current.get("wind_speed"), 0.0)
+    clouds_now = _safe_float(current.get("clouds"), 0.0)
+    temp_now = _safe_float(current.get("temp"), 0.0)
 
-    rv = safe_float(rain_val, 0.0)
+    rv = _safe_float(rain_val, 0.0)
 
-    # Logic hiển thị icon + mô tả
+    # Logic hiển thị icon + mô tả (mức mưa/nhiệt tra bảng theo ngưỡng)
     if rv > 0 and wind_now > 6:
         icon_now, desc = "⛈️", "Mưa to kèm gió mạnh"
     elif rv > 0:
-        if rv < 1:
-            icon_now, desc = "🌦️", "Mưa rất nhẹ"
-        elif rv < 5:
-            icon_now, desc = "🌧️", "Mưa nhẹ"
-        elif rv < 20:
-            icon_now, desc = "🌧️", "Mưa vừa"
-        else:
-            icon_now, desc = "⛈️", "Mưa to"
+        icon_now, desc = RAIN_LEVELS[bisect_right(RAIN_BINS, rv)]
     elif wind_now > 6:
         icon_now, desc = "💨", "Gió mạnh"
     elif clouds_now > 70:
         icon_now, desc = "☁️", "Nhiều mây"
     else:
-        if temp_now >= 33:
-            icon_now, desc = "🔥", "Nắng nóng gay gắt"
-        elif temp_now >= 28:
-            icon_now, desc = "☀️", "Nắng mạnh"
-        elif temp_now >= 23:
-            icon_now, desc = "🌤️", "Nắng nhẹ"
-        else:
-            icon_now, desc = "☀️", "Trời quang mát"
+        # NaN không đạt ngưỡng nào → mức thấp nhất như chuỗi so sánh cũ
+        icon_now, desc = TEMP_LEVELS[bisect_right(TEMP_BINS, temp_now) if temp_now >= TEMP_BINS[0] else 0]
 
     return {
         "temp": f"{temp_now:.1f}°C" if temp_now != 0.0 else "-",
@@ -1,10 +1,15 @@
 # services/etl.py
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
 
 from services.openweather import OWM
 from services.weatherapi import WeatherAPI
 from services.openmeteo import OpenMeteo
+from services.cache import FETCH_TTL, TTLCache
 
 # ==============================
 # Reliability tracking (ưu tiên: WeatherAPI > OpenMeteo > OpenWeather)
@@ -22,34 +27,222 @@ DEVIATION_COUNT = {
 }
 
 
+@lru_cache(maxsize=8)
+def _rank_sources(scores: tuple) -> tuple:
+    """(nguồn, reliability) xếp giảm dần; khóa là ảnh chụp RELIABILITY nên tự làm mới khi điểm đổi."""
+    return tuple(sorted(scores, key=lambda x: x[1], reverse=True))
+
+
+def _sources_by_reliability() -> tuple:
+    """Thứ tự ưu tiên nguồn theo reliability hiện tại (sắp xếp lại chỉ khi điểm thay đổi)."""
+    return _rank_sources(tuple(RELIABILITY.items()))
+
+
 # ==============================
 # Collect data from sources
 # ==============================
-def _safe_fetch(source, lat, lon):
-    """Bọc gọi API từng nguồn, trả về dict current/hourly/daily; lỗi thì trả về {}."""
+# Các request HTTP chỉ chờ mạng → chạy song song trên pool luồng dùng chung.
+# "forecast" = fetch_forecast: hourly + daily lấy từ cùng một response của nguồn
+FETCH_KINDS = ("current", "forecast")
+_FETCH_POOL = ThreadPoolExecutor(max_workers=18, thread_name_prefix="etl-fetch")
+
+
+# Cache theo (nguồn, loại, lat, lon làm tròn), TTL theo loại (FETCH_TTL)
+_FETCH_CACHE = TTLCache(ttl=FETCH_TTL["forecast"], maxsize=1024)
+
+
+def _is_empty(result) -> bool:
+    if result is None:
+        return True
+    if isinstance(result, pd.DataFrame):
+        return result.empty
+    if isinstance(result, dict) and result and all(isinstance(v, pd.DataFrame) for v in result.values()):
+        return all(v.empty for v in result.values())  # kết quả fetch_forecast
+    return not result
+
+
+def _fetch_one(source, kind, lat, lon):
+    """
+    Gọi source.fetch_<kind>, dùng lại kết quả còn hạn trong cache.
+    Nguồn lỗi hoặc trả về rỗng → dùng bản cũ (đã hết hạn) nếu có, để merge vẫn có dữ liệu.
+    """
+    key = (getattr(source, "name", None), kind, round(lat, 2), round(lon, 2))
+    result = _FETCH_CACHE.get(key)
+    if result is not None:
+        return result
+
     try:
-        return {
-            "current": source.fetch_current(lat, lon),
-            "hourly": source.fetch_hourly(lat, lon),
-            "daily": source.fetch_daily(lat, lon)
-        }
+        result = getattr(source, f"fetch_{kind}")(lat, lon)
+    except Exception:
+        stale = _FETCH_CACHE.get_stale(key)
+        if stale is None:
+            raise
+        print(f"⚠️ Lỗi {key[0]} ({kind}), dùng dữ liệu cũ trong cache")
+        return stale
+
+    if _is_empty(result):
+        return _FETCH_CACHE.get_stale(key, result)
+    _FETCH_CACHE.set(key, result, ttl=FETCH_TTL[kind])
+    return result
+
+
+def _submit_fetch(source, lat, lon) -> dict:
+    """Gửi 2 request current/forecast của một nguồn lên pool, trả về dict Future."""
+    return {kind: _FETCH_POOL.submit(_fetch_one, source, kind, lat, lon) for kind in FETCH_KINDS}
+
+
+def _gather_fetch(source, futures: dict) -> dict:
+    """Chờ kết quả các Future của một nguồn → dict current/hourly/daily; lỗi bất kỳ request nào thì trả về {}."""
+    try:
+        forecast = futures["forecast"].result() or {}
+        return {"current": futures["current"].result(), "hourly": forecast.get("hourly"), "daily": forecast.get("daily")}
     except Exception as e:
-        print(f"⚠️ Lỗi {source.name}: {e}")
+        print(f"⚠️ Lỗi {getattr(source, 'name', source)}: {e}")
         return {}
 
 
+def _safe_fetch(source, lat, lon):
+    """Bọc gọi API từng nguồn, trả về dict current/hourly/daily; lỗi thì trả về {}."""
+    return _gather_fetch(source, _submit_fetch(source, lat, lon))
+
+
+# Lượt thu thập đang chạy theo (lat, lon) làm tròn: lời gọi đồng thời cùng vị trí chờ chung một lượt
+_INFLIGHT: dict[tuple, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _collect(lat: float, lon: float) -> dict:
+    sources = {"weatherapi": WeatherAPI, "openmeteo": OpenMeteo, "openweather": OWM}
+    pending = {name: _submit_fetch(src, lat, lon) for name, src in sources.items()}
+    return {name: _gather_fetch(sources[name], futures) for name, futures in pending.items()}
+
+
 def collect_sources(lat: float, lon: float) -> dict:
-    """Thu thập dữ liệu từ 3 nguồn (WeatherAPI, OpenMeteo, OpenWeather)."""
-    return {
-        "weatherapi": _safe_fetch(WeatherAPI, lat, lon),
-        "openmeteo": _safe_fetch(OpenMeteo, lat, lon),
-        "openweather": _safe_fetch(OWM, lat, lon)
-    }
+    """
+    Thu thập dữ liệu từ 3 nguồn (WeatherAPI, OpenMeteo, OpenWeather); cả 6 request chạy đồng thời.
+    Nhiều lời gọi cùng lúc cho cùng vị trí chỉ chạy một lượt, các lời gọi sau chờ và dùng chung kết quả.
+    """
+    key = (round(lat, 2), round(lon, 2))
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner:
+            future = _INFLIGHT[key] = Future()
+
+    if owner:
+        try:
+            future.set_result(_collect(lat, lon))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _INFLIGHT_LOCK:
+                del _INFLIGHT[key]
+
+    # Mỗi lời gọi nhận dict riêng (DataFrame bên trong vẫn dùng chung như bản trong cache)
+    return {name: dict(data) for name, data in future.result().items()}
 
 
 # ==============================
 # Merge strategies
 # ==============================
+def _has_data(df: pd.DataFrame) -> bool:
+    """Như not df.dropna(how="all").empty, nhưng thường chỉ cần xem cột ts thay vì mask cả frame."""
+    if "ts" in df.columns and df["ts"].notna().any():
+        return True
+    return bool(df.notna().to_numpy().any())
+
+
+def _groupby_ts(combined: pd.DataFrame, how: str = "mean") -> pd.DataFrame:
+    """
+    Gom các dòng cùng ts, tương đương
+    combined.groupby("ts", sort=False).<how>(numeric_only=True).reset_index()
+    nhưng tính bằng np.add.reduceat trên mảng đã sắp theo nhóm (không qua groupby).
+    - how="mean": trung bình bỏ qua NaN (nhóm toàn NaN → NaN), kết quả float
+    - how="sum": tổng bỏ qua NaN (nhóm toàn NaN → 0), cột nguyên giữ kiểu nguyên
+    - Nhóm theo thứ tự xuất hiện đầu tiên của ts; ts rỗng (NaT) bị bỏ
+    """
+    dtypes = combined.dtypes
+    num_cols = [c for c in combined.columns if c != "ts" and pd.api.types.is_numeric_dtype(dtypes[c])]
+    codes, uniques = pd.factorize(combined["ts"].array, sort=False)
+    valid = codes >= 0
+    if not valid.any():
+        return pd.DataFrame(columns=["ts"] + num_cols)
+
+    vals = combined[num_cols].to_numpy(dtype=float)
+    if not valid.all():
+        codes, vals = codes[valid], vals[valid]
+    order = np.argsort(codes, kind="stable")
+    starts = np.searchsorted(codes[order], np.arange(len(uniques)))
+    vals = vals[order]
+    present = ~np.isnan(vals)
+    sums = np.add.reduceat(np.where(present, vals, 0.0), starts, axis=0)
+
+    if how == "mean":
+        counts = np.add.reduceat(present, starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = np.where(counts > 0, sums / counts, np.nan)
+        columns = {col: out[:, i] for i, col in enumerate(num_cols)}
+    else:
+        columns = {
+            col: sums[:, i].astype(np.int64) if dtypes[col].kind in "iub" else sums[:, i]
+            for i, col in enumerate(num_cols)
+        }
+    return pd.DataFrame({"ts": uniques, **columns})
+
+
+# Thứ tự ưu tiên cố định của chiến lược "best"
+SOURCE_PRIORITY = ("weatherapi", "openmeteo", "openweather")
+
+
+def _first_available(results: dict, field: str):
+    """Bản đầu tiên có dữ liệu của field theo SOURCE_PRIORITY (current cần có temp)."""
+    for src in SOURCE_PRIORITY:
+        val = results.get(src, {}).get(field)
+        if field == "current":
+            if val and val.get("temp") is not None:
+                return val
+        elif isinstance(val, pd.DataFrame) and not val.empty:
+            return val
+    return {} if field == "current" else None
+
+
+def _merge_best(results: dict) -> dict:
+    """Chọn nguồn khả dụng nhất theo thứ tự ưu tiên WeatherAPI → OpenMeteo → OpenWeather."""
+    return {field: _first_available(results, field) for field in ("current", "hourly", "daily")}
+
+
+def _mean_frames(results: dict, field: str):
+    """Trung bình theo ts của field (hourly/daily) trên các nguồn có dữ liệu."""
+    dfs = [
+        src.get(field)
+        for src in results.values()
+        if isinstance(src.get(field), pd.DataFrame) and not src.get(field).empty
+    ]
+    # Bỏ df toàn NA (như trước khi concat); chúng không được tính vào kiểu cột
+    dfs = [d for d in dfs if _has_data(d)]
+    return _groupby_ts(pd.concat(dfs, ignore_index=True), "mean") if dfs else None
+
+
+def _merge_avg(results: dict) -> dict:
+    """Lấy trung bình từ các nguồn có dữ liệu."""
+    temps, hums, press, winds = [], [], [], []
+    for src in results.values():
+        cur = src.get("current", {})
+        if cur:
+            if cur.get("temp") is not None: temps.append(cur["temp"])
+            if cur.get("humidity") is not None: hums.append(cur["humidity"])
+            if cur.get("pressure") is not None: press.append(cur["pressure"])
+            if cur.get("wind_speed") is not None: winds.append(cur["wind_speed"])
+    current = {
+        "temp": float(np.mean(temps)) if temps else None,
+        "humidity": float(np.mean(hums)) if hums else None,
+        "pressure": float(np.mean(press)) if press else None,
+        "wind_speed": float(np.mean(winds)) if winds else None,
+        "source": "avg"
+    }
+    return {"current": current, "hourly": _mean_frames(results, "hourly"), "daily": _mean_frames(results, "daily")}
+
+
 def merge_sources(results: dict, strategy: str = "best") -> dict:
     """
     Hợp nhất dữ liệu từ nhiều nguồn.
@@ -57,80 +250,11 @@ def merge_sources(results: dict, strategy: str = "best") -> dict:
         - "best": chọn nguồn khả dụng nhất theo thứ tự ưu tiên WeatherAPI → OpenMeteo → OpenWeather
         - "avg": lấy trung bình từ các nguồn có dữ liệu
     """
-    merged = {"current": {}, "hourly": None, "daily": None}
-
-    # --- CURRENT ---
-    if strategy == "best":
-        for src in ["weatherapi", "openmeteo", "openweather"]:
-            cur = results.get(src, {}).get("current", {})
-            if cur and cur.get("temp") is not None:
-                merged["current"] = cur
-                break
-    elif strategy == "avg":
-        temps, hums, press, winds = [], [], [], []
-        for src in results.values():
-            cur = src.get("current", {})
-            if cur:
-                if cur.get("temp") is not None: temps.append(cur["temp"])
-                if cur.get("humidity") is not None: hums.append(cur["humidity"])
-                if cur.get("pressure") is not None: press.append(cur["pressure"])
-                if cur.get("wind_speed") is not None: winds.append(cur["wind_speed"])
-        merged["current"] = {
-            "temp": float(np.mean(temps)) if temps else None,
-            "humidity": float(np.mean(hums)) if hums else None,
-            "pressure": float(np.mean(press)) if press else None,
-            "wind_speed": float(np.mean(winds)) if winds else None,
-            "source": "avg"
-        }
-
-    # --- HOURLY ---
-    if strategy == "best":
-        for src in ["weatherapi", "openmeteo", "openweather"]:
-            df = results.get(src, {}).get("hourly")
-            if isinstance(df, pd.DataFrame) and not df.empty:
-                merged["hourly"] = df
-                break
-    elif strategy == "avg":
-        dfs = [
-            src.get("hourly")
-            for src in results.values()
-            if isinstance(src.get("hourly"), pd.DataFrame) and not src.get("hourly").empty
-        ]
-        if dfs:
-            # Tránh FutureWarning: lọc rỗng trước khi concat
-            dfs = [d for d in dfs if not d.dropna(how="all").empty]
-            if dfs:
-                merged["hourly"] = (
-                    pd.concat(dfs, ignore_index=True)
-                      .groupby("ts", sort=False)
-                      .mean(numeric_only=True)
-                      .reset_index()
-                )
-
-    # --- DAILY ---
     if strategy == "best":
-        for src in ["weatherapi", "openmeteo", "openweather"]:
-            df = results.get(src, {}).get("daily")
-            if isinstance(df, pd.DataFrame) and not df.empty:
-                merged["daily"] = df
-                break
-    elif strategy == "avg":
-        dfs = [
-            src.get("daily")
-            for src in results.values()
-            if isinstance(src.get("daily"), pd.DataFrame) and not src.get("daily").empty
-        ]
-        if dfs:
-            dfs = [d for d in dfs if not d.dropna(how="all").empty]
-            if dfs:
-                merged["daily"] = (
-                    pd.concat(dfs, ignore_index=True)
-                      .groupby("ts", sort=False)
-                      .mean(numeric_only=True)
-                      .reset_index()
-                )
-
-    return merged
+        return _merge_best(results)
+    if strategy == "avg":
+        return _merge_avg(results)
+    return {"current": {}, "hourly": None, "daily": None}
 
 
 # ==============================
@@ -139,7 +263,7 @@ def merge_sources(results: dict, strategy: str = "best") -> dict:
 def merge_sources_dynamic(results: dict) -> dict:
     """Chọn nguồn có reliability cao nhất và chuẩn hóa dữ liệu daily."""
     merged = {"current": {}, "hourly": None, "daily": None}
-    sorted_sources = sorted(RELIABILITY.items(), key=lambda x: x[1], reverse=True)
+    sorted_sources = _sources_by_reliability()
 
     # --- CURRENT ---
     for src, _ in sorted_sources:
@@ -168,6 +292,16 @@ def merge_sources_dynamic(results: dict) -> dict:
 # ==============================
 # Weighted average merge
 # ==============================
+def _apply_weight(df: pd.DataFrame, cols: list, score: float) -> pd.DataFrame:
+    """
+    Bản sao df với các cột số trong cols nhân trọng số score (một phép nhân trên khối 2D) và cột weight.
+    Cột không phải kiểu số (vd. toàn None) giữ nguyên để concat/numeric_only vẫn bỏ qua như trước.
+    """
+    cols = [c for c in cols if c in df.columns and pd.api.types.is_numeric_dtype(df[c])]
+    block = df[cols].to_numpy(dtype=float) * score
+    return df.assign(**{c: block[:, i] for i, c in enumerate(cols)}, weight=score)
+
+
 def merge_sources_weighted(results: dict) -> dict:
     """Trung bình có trọng số theo reliability cho current, hourly, daily."""
     merged = {"current": {}, "hourly": None, "daily": None}
@@ -206,45 +340,31 @@ def merge_sources_weighted(results: dict) -> dict:
     for src, score in RELIABILITY.items():
         df = results.get(src, {}).get("hourly")
         if isinstance(df, pd.DataFrame) and not df.empty:
-            df = df.copy()
-            for col in ["temp", "rain", "wind_speed", "humidity"]:
-                if col in df.columns:
-                    df[col] = df[col] * score
-            df["weight"] = score
+            df = _apply_weight(df, ["temp", "rain", "wind_speed", "humidity"], score)
             dfs_hourly.append(df)
 
     if dfs_hourly:
-        dfs_hourly = [d for d in dfs_hourly if not d.dropna(how="all").empty]
-        if dfs_hourly:
-            combined = pd.concat(dfs_hourly, ignore_index=True)
-            grouped = combined.groupby("ts", sort=False).sum(numeric_only=True).reset_index()
-            for col in ["temp", "rain", "wind_speed", "humidity"]:
-                if col in grouped.columns and "weight" in grouped.columns and grouped["weight"].sum() != 0:
-                    grouped[col] = grouped[col] / grouped["weight"]
-            merged["hourly"] = grouped.drop(columns=["weight"]) if "weight" in grouped.columns else grouped
+        grouped = _groupby_ts(pd.concat(dfs_hourly, ignore_index=True), "sum")
+        for col in ["temp", "rain", "wind_speed", "humidity"]:
+            if col in grouped.columns and "weight" in grouped.columns and grouped["weight"].sum() != 0:
+                grouped[col] = grouped[col] / grouped["weight"]
+        merged["hourly"] = grouped.drop(columns=["weight"]) if "weight" in grouped.columns else grouped
 
     # --- DAILY ---
     dfs_daily = []
     for src, score in RELIABILITY.items():
         df = results.get(src, {}).get("daily")
         if isinstance(df, pd.DataFrame) and not df.empty:
-            df = _normalize_daily(df, src).copy()
-            for col in ["temp_min", "temp_max", "rain", "wind_speed"]:
-                if col in df.columns:
-                    df[col] = df[col] * score
-            df["weight"] = score
+            df = _apply_weight(_normalize_daily(df, src), ["temp_min", "temp_max", "rain", "wind_speed"], score)
             dfs_daily.append(df)
 
     if dfs_daily:
-        dfs_daily = [d for d in dfs_daily if not d.dropna(how="all").empty]
-        if dfs_daily:
-            combined = pd.concat(dfs_daily, ignore_index=True)
-            grouped = combined.groupby("ts", sort=False).sum(numeric_only=True).reset_index()
-            for col in ["temp_min", "temp_max", "rain", "wind_speed"]:
-                if col in grouped.columns and "weight" in grouped.columns and grouped["weight"].sum() != 0:
-                    grouped[col] = grouped[col] / grouped["weight"]
-            daily_out = grouped.drop(columns=["weight"]) if "weight" in grouped.columns else grouped
-            merged["daily"] = _normalize_daily(daily_out, "avg")
+        grouped = _groupby_ts(pd.concat(dfs_daily, ignore_index=True), "sum")
+        for col in ["temp_min", "temp_max", "rain", "wind_speed"]:
+            if col in grouped.columns and "weight" in grouped.columns and grouped["weight"].sum() != 0:
+                grouped[col] = grouped[col] / grouped["weight"]
+        daily_out = grouped.drop(columns=["weight"]) if "weight" in grouped.columns else grouped
+        merged["daily"] = _normalize_daily(daily_out, "avg")
 
     return merged
 
@@ -264,21 +384,29 @@ def update_reliability_multi(results: dict,
             "wind_speed": 2.0
         }
 
-    for metric in metrics:
-        values, sources = [], []
-        for src, data in results.items():
-            cur = data.get("current", {})
-            if cur and cur.get(metric) is not None:
-                values.append(cur[metric])
-                sources.append(src)
-
-        if len(values) < 2:
-            continue
-
-        avg_val = float(np.mean(values))
-        for src, val in zip(sources, values):
-            deviation = abs(val - avg_val)
-            if deviation > thresholds.get(metric, 1.0):
+    # Ma trận (nguồn × chỉ số) trong một lượt; None = nguồn không có chỉ số đó (NaN thật vẫn giữ)
+    rows = [(src, data.get("current", {})) for src, data in results.items()]
+    rows = [(src, [cur.get(metric) for metric in metrics]) for src, cur in rows if cur]
+    if len(rows) < 2:
+        return
+    present = np.array([[val is not None for val in vals] for _, vals in rows])
+    values = np.array([vals for _, vals in rows], dtype=float)
+
+    # Độ lệch so với trung bình từng chỉ số (chỉ xét chỉ số có ít nhất 2 nguồn)
+    counts = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(present, values, 0.0).sum(axis=0) / counts
+    limits = np.array([thresholds.get(metric, 1.0) for metric in metrics])
+    bad = (np.abs(values - means) > limits).tolist()
+    present = present.tolist()
+    active = [j for j, n in enumerate(counts.tolist()) if n >= 2]
+
+    # Cập nhật lần lượt từng chỉ số (chặn [0, 2] sau mỗi bước)
+    for j in active:
+        for (src, _), has, off in zip(rows, present, bad):
+            if not has[j]:
+                continue
+            if off[j]:
                 RELIABILITY[src] = max(RELIABILITY[src] - 0.2, 0.0)
                 DEVIATION_COUNT[src] += 1
             else:
@@ -300,6 +428,15 @@ def reliability_report() -> pd.DataFrame:
 # ==============================
 # Forecast preparation
 # ==============================
+# Chiến lược → hàm merge (chiến lược lạ dùng "best")
+MERGERS = {
+    "best": _merge_best,
+    "avg": _merge_avg,
+    "dynamic": merge_sources_dynamic,
+    "weighted": merge_sources_weighted,
+}
+
+
 def prepare_forecast(lat: float, lon: float, strategy: str = "best") -> dict:
     """
     Gom dữ liệu từ 3 nguồn và hợp nhất theo chiến lược.
@@ -310,15 +447,7 @@ def prepare_forecast(lat: float, lon: float, strategy: str = "best") -> dict:
         - "weighted": trung bình có trọng số theo reliability
     """
     results = collect_sources(lat, lon)
-
-    if strategy in ["best", "avg"]:
-        merged = merge_sources(results, strategy=strategy)
-    elif strategy == "dynamic":
-        merged = merge_sources_dynamic(results)
-    elif strategy == "weighted":
-        merged = merge_sources_weighted(results)
-    else:
-        merged = merge_sources(results, strategy="best")
+    merged = MERGERS.get(strategy, _merge_best)(results)
 
     # Cập nhật reliability sau mỗi lần merge
     update_reliability_multi(results)
@@ -0,0 +1,38 @@
+# services/http_client.py
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Số host giữ pool kết nối và số kết nối song song tối đa mỗi host
+# (đủ cho pool fetch của etl và của API chạy cùng lúc)
+HTTP_POOL_CONNECTIONS = 8
+HTTP_POOL_MAXSIZE = 32
+
+# Lỗi gateway tạm thời (502/503/504): thử lại tối đa 2 lần, chờ 0.3s, 0.6s.
+# Lỗi kết nối chỉ thử lại 1 lần; hết thời gian đọc thì không thử lại (upstream treo sẽ treo tiếp
+# và giữ luồng fetch thêm trọn một read timeout mỗi lần thử)
+HTTP_RETRY = Retry(total=2, connect=1, read=0, backoff_factor=0.3, status_forcelist=(502, 503, 504), raise_on_status=False)
+# (connect, read): host chết thì bỏ sau ~6s (2 lần connect), upstream không trả lời thì sau 20s
+HTTP_TIMEOUT = (3.05, 20)
+
+
+def _make_session() -> requests.Session:
+    """Session dùng chung: giữ kết nối keep-alive (không bắt tay TCP/TLS lại cho mỗi request), tự thử lại lỗi tạm thời."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=HTTP_RETRY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = _make_session()
+
+
+def get_content(url: str, params: dict, timeout=HTTP_TIMEOUT) -> bytes:
+    """
+    GET url qua SESSION và trả về body (bytes); lỗi HTTP/mạng ném ra cho nguồn tự xử lý.
+    Không cache ở tầng này: cache fetch (api/app_utils, services/etl) quyết định độ mới và dữ liệu dự phòng.
+    """
+    resp = SESSION.get(url, params=params, timeout=timeout)
+    resp.raise_for_status()
+    return resp.content
@@ -1,12 +1,18 @@
 # services/openmeteo.py
 import os
-import requests
+import orjson
 import pandas as pd
 from datetime import datetime, timezone
 
+from services.http_client import get_content
+
 # Đọc biến môi trường để bật/tắt OpenMeteo
 OPENMETEO_ENABLED = os.getenv("OPENMETEO_ENABLED", "true").lower() == "true"
 
+# Biến dự báo cần lấy (dùng chung cho request riêng lẻ và request gộp hourly + daily)
+HOURLY_VARS = "temperature_2m,relativehumidity_2m,pressure_msl,windspeed_10m,cloudcover,precipitation"
+DAILY_VARS = "temperature_2m_max,temperature_2m_min,precipitation_sum,windspeed_10m_max"
+
 
 class OpenMeteoSource:
     def __init__(self, name: str = "openmeteo", base_url: str = "https://api.open-meteo.com/v1/forecast"):
@@ -16,9 +22,7 @@ class OpenMeteoSource:
     def _request(self, params: dict) -> dict:
         """Hàm gọi API chung"""
         try:
-            resp = requests.get(self.base_url, params=params, timeout=20)
-            resp.raise_for_status()
-            return resp.json()
+            return orjson.loads(get_content(self.base_url, params))
         except Exception as e:
             print(f"⚠️ Lỗi khi gọi Open-Meteo: {e}")
             return {}
@@ -52,22 +56,14 @@ class OpenMeteoSource:
             print(f"⚠️ Lỗi parse dữ liệu Open-Meteo current: {e}")
             return {}
 
-    def fetch_hourly(self, lat: float, lon: float, hours: int = 24) -> pd.DataFrame:
-        """Lấy dữ liệu theo giờ"""
-        data = self._request({
-            "latitude": lat,
-            "longitude": lon,
-            "hourly": "temperature_2m,relativehumidity_2m,pressure_msl,windspeed_10m,cloudcover,precipitation",
-            "forecast_days": 2,
-            "timezone": "auto"
-        }).get("hourly", {})
-
+    def _parse_hourly(self, data: dict, hours: int) -> pd.DataFrame:
+        """Khối 'hourly' của response → DataFrame theo giờ"""
         if not data:
             return pd.DataFrame()
 
         try:
             df = pd.DataFrame({
-                "ts": pd.to_datetime(data.get("time"), utc=True),
+                "ts": pd.to_datetime(data.get("time"), utc=True, format="ISO8601"),
                 "temp": data.get("temperature_2m"),
                 "humidity": data.get("relativehumidity_2m"),
                 "pressure": data.get("pressure_msl"),
@@ -82,22 +78,14 @@ class OpenMeteoSource:
             print(f"⚠️ Lỗi parse dữ liệu Open-Meteo hourly: {e}")
             return pd.DataFrame()
 
-    def fetch_daily(self, lat: float, lon: float, days: int = 7) -> pd.DataFrame:
-        """Lấy dữ liệu theo ngày"""
-        data = self._request({
-            "latitude": lat,
-            "longitude": lon,
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,windspeed_10m_max",
-            "forecast_days": days,
-            "timezone": "auto"
-        }).get("daily", {})
-
+    def _parse_daily(self, data: dict, days: int) -> pd.DataFrame:
+        """Khối 'daily' của response → DataFrame theo ngày"""
         if not data:
             return pd.DataFrame()
 
         try:
             df = pd.DataFrame({
-                "ts": pd.to_datetime(data.get("time"), utc=True),
+                "ts": pd.to_datetime(data.get("time"), utc=True, format="ISO8601"),
                 "temp_min": data.get("temperature_2m_min"),
                 "temp_max": data.get("temperature_2m_max"),
                 "humidity": None,
@@ -113,5 +101,42 @@ class OpenMeteoSource:
             print(f"⚠️ Lỗi parse dữ liệu Open-Meteo daily: {e}")
             return pd.DataFrame()
 
+    def fetch_hourly(self, lat: float, lon: float, hours: int = 24) -> pd.DataFrame:
+        """Lấy dữ liệu theo giờ"""
+        data = self._request({
+            "latitude": lat,
+            "longitude": lon,
+            "hourly": HOURLY_VARS,
+            "forecast_days": 2,
+            "timezone": "auto"
+        }).get("hourly", {})
+        return self._parse_hourly(data, hours)
+
+    def fetch_daily(self, lat: float, lon: float, days: int = 7) -> pd.DataFrame:
+        """Lấy dữ liệu theo ngày"""
+        data = self._request({
+            "latitude": lat,
+            "longitude": lon,
+            "daily": DAILY_VARS,
+            "forecast_days": days,
+            "timezone": "auto"
+        }).get("daily", {})
+        return self._parse_daily(data, days)
+
+    def fetch_forecast(self, lat: float, lon: float, hours: int = 24, days: int = 7) -> dict:
+        """Lấy cả dữ liệu theo giờ và theo ngày trong một request (hourly + daily cùng params)"""
+        data = self._request({
+            "latitude": lat,
+            "longitude": lon,
+            "hourly": HOURLY_VARS,
+            "daily": DAILY_VARS,
+            "forecast_days": max(days, 2),
+            "timezone": "auto"
+        })
+        return {
+            "hourly": self._parse_hourly(data.get("hourly", {}), hours),
+            "daily": self._parse_daily(data.get("daily", {}), days),
+        }
+
 # Khởi tạo instance để dùng trong app
 OpenMeteo = OpenMeteoSource() if OPENMETEO_ENABLED else None
@@ -2,10 +2,109 @@
 from dotenv import load_dotenv
 load_dotenv()
 import os
+import orjson
 import requests
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
 
+from services.http_client import get_content
+
+def _ts_col(items: list) -> pd.DatetimeIndex:
+    """Cột thời gian UTC từ epoch 'dt' của cả danh sách (một lần chuyển đổi)."""
+    return pd.to_datetime(np.fromiter((item["dt"] for item in items), dtype=np.int64, count=len(items)), unit="s", utc=True)
+
+
+def _desc_col(items: list) -> list:
+    return [item.get("weather", [{}])[0].get("description", "") for item in items]
+
+
+def _forecast_columns(items: list, name: str) -> dict:
+    """Danh sách bản ghi forecast 5 ngày/3 giờ → dict cột cho pd.DataFrame (mỗi trường một lượt)."""
+    main = [item.get("main", {}) for item in items]
+    wind = [item.get("wind", {}) for item in items]
+    return {
+        "ts": _ts_col(items),
+        "temp": [m.get("temp") for m in main],
+        "humidity": [m.get("humidity") for m in main],
+        "pressure": [m.get("pressure") for m in main],
+        "wind_speed": [w.get("speed") for w in wind],
+        "wind_deg": [w.get("deg") for w in wind],
+        "clouds": [item.get("clouds", {}).get("all") for item in items],
+        "rain": np.array([float(item.get("rain", {}).get("3h", 0.0) or 0.0) for item in items], dtype=float),
+        "weather_desc": _desc_col(items),
+        "source": name
+    }
+
+
+# Gộp bản ghi 3 giờ thành ngày: (cột nguồn, phép gộp, cột kết quả), theo thứ tự cột đầu ra
+DAILY_AGG = (
+    ("temp", "min", "temp_min"),
+    ("temp", "max", "temp_max"),
+    ("humidity", "mean", "humidity"),
+    ("pressure", "mean", "pressure"),
+    ("wind_speed", "mean", "wind_speed"),
+    ("wind_deg", "mean", "wind_deg"),
+    ("clouds", "mean", "clouds"),
+    ("rain", "sum", "rain"),
+)
+
+
+def _daily_groupby(df: pd.DataFrame) -> pd.DataFrame:
+    """Gộp theo ngày (UTC) bằng groupby.agg; dùng khi có cột không phải số."""
+    df = df.assign(date=df["ts"].dt.date)
+    daily = df.groupby("date").agg({
+        "temp": ["min", "max"],
+        "humidity": "mean",
+        "pressure": "mean",
+        "wind_speed": "mean",
+        "wind_deg": "mean",
+        "clouds": "mean",
+        "rain": "sum"
+    }).reset_index()
+    daily.columns = ["ts"] + [out for _, _, out in DAILY_AGG]
+    return daily
+
+
+def _daily_from_forecast(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Bản ghi forecast 3 giờ → dự báo ngày (ts là date UTC), tương đương _daily_groupby
+    nhưng tính bằng reduceat trên mảng đã sắp theo ngày (không dựng GroupBy).
+    min/max/mean bỏ qua NaN (nhóm toàn NaN → NaN), sum nhóm toàn NaN → 0; cột nguyên giữ kiểu nguyên ở min/max/sum.
+    """
+    if df.empty or any(df[col].dtype.kind not in "iuf" for col, _, _ in DAILY_AGG):
+        return _daily_groupby(df)
+
+    days = df["ts"].to_numpy("datetime64[ns]").astype("datetime64[D]")
+    order = np.argsort(days, kind="stable")
+    order = order[~np.isnat(days[order])]
+    if not len(order):
+        return _daily_groupby(df)
+    days = days[order]
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+
+    columns = {"ts": days[starts].astype(object)}
+    prepared = {}
+    for col, how, name in DAILY_AGG:
+        if col not in prepared:
+            vals = df[col].to_numpy(dtype=float)[order]
+            present = ~np.isnan(vals)
+            prepared[col] = (vals, present, np.add.reduceat(np.where(present, vals, 0.0), starts))
+        vals, present, sums = prepared[col]
+        if how == "min":
+            res = np.fmin.reduceat(vals, starts)
+        elif how == "max":
+            res = np.fmax.reduceat(vals, starts)
+        elif how == "sum":
+            res = sums
+        else:
+            counts = np.add.reduceat(present, starts)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                res = np.where(counts > 0, sums / counts, np.nan)
+        columns[name] = res.astype(np.int64) if how != "mean" and df[col].dtype.kind in "iu" else res
+    return pd.DataFrame(columns)
+
+
 class OpenWeatherSource:
     def __init__(self, name: str, api_key: str | None):
         self.name = name
@@ -20,11 +119,9 @@ class OpenWeatherSource:
         params["appid"] = self.api_key
         params["units"] = "metric"
         try:
-            resp = requests.get(url, params=params, timeout=20)
-            resp.raise_for_status()
-            return resp.json()
+            return orjson.loads(get_content(url, params))
         except requests.exceptions.HTTPError as e:
-            if resp.status_code == 401:
+            if e.response is not None and e.response.status_code == 401:
                 print(f"⚠️ Unauthorized for {url}, sẽ fallback sang forecast.")
                 return {"error": "unauthorized"}
             print(f"⚠️ Lỗi khi gọi OWM ({url}): {e}")
@@ -44,7 +141,7 @@ class OpenWeatherSource:
                 rain_val = float(data["rain"].get("1h", 0.0) or 0.0)
 
             return {
-                "ts": datetime.utcfromtimestamp(data.get("dt", 0)).replace(tzinfo=timezone.utc),
+                "ts": datetime.fromtimestamp(data.get("dt", 0), timezone.utc),
                 "temp": data.get("main", {}).get("temp"),
                 "humidity": data.get("main", {}).get("humidity"),
                 "pressure": data.get("main", {}).get("pressure"),
@@ -59,84 +156,51 @@ class OpenWeatherSource:
             print(f"⚠️ Lỗi parse dữ liệu OWM current: {e}")
             return {}
 
-    def fetch_hourly(self, lat: float, lon: float, hours: int = 24) -> pd.DataFrame:
-        data = self._request(f"{self.base_url_onecall}/onecall", {
-            "lat": lat, "lon": lon, "exclude": "minutely,daily,alerts"
-        })
+    def _onecall(self, lat: float, lon: float, exclude: str) -> tuple[dict, bool]:
+        """
+        OneCall API v3.0; unauthorized/lỗi thì fallback sang forecast 5-day/3-hour.
+        Trả về (payload, True nếu là payload OneCall).
+        """
+        data = self._request(f"{self.base_url_onecall}/onecall", {"lat": lat, "lon": lon, "exclude": exclude})
         if not data or "error" in data:
-            forecast = self._request(f"{self.base_url_current}/forecast", {"lat": lat, "lon": lon})
-            if not forecast or "list" not in forecast:
+            return self._request(f"{self.base_url_current}/forecast", {"lat": lat, "lon": lon}), False
+        return data, True
+
+    def _parse_hourly(self, data: dict, is_onecall: bool, hours: int) -> pd.DataFrame:
+        if not is_onecall:
+            if not data or "list" not in data:
                 return pd.DataFrame()
             try:
-                records = [{
-                    "ts": datetime.utcfromtimestamp(item["dt"]).replace(tzinfo=timezone.utc),
-                    "temp": item.get("main", {}).get("temp"),
-                    "humidity": item.get("main", {}).get("humidity"),
-                    "pressure": item.get("main", {}).get("pressure"),
-                    "wind_speed": item.get("wind", {}).get("speed"),
-                    "wind_deg": item.get("wind", {}).get("deg"),
-                    "clouds": item.get("clouds", {}).get("all"),
-                    "rain": float(item.get("rain", {}).get("3h", 0.0) or 0.0),
-                    "weather_desc": item.get("weather", [{}])[0].get("description", ""),
-                    "source": self.name
-                } for item in forecast.get("list", [])[:hours]]
-                return pd.DataFrame(records)
+                return pd.DataFrame(_forecast_columns(data.get("list", [])[:hours], self.name))
             except Exception as e:
                 print(f"⚠️ Lỗi parse forecast hourly: {e}")
                 return pd.DataFrame()
 
         try:
             hourly = data.get("hourly", [])[:hours]
-            records = [{
-                "ts": datetime.utcfromtimestamp(item["dt"]).replace(tzinfo=timezone.utc),
-                "temp": item.get("temp"),
-                "humidity": item.get("humidity"),
-                "pressure": item.get("pressure"),
-                "wind_speed": item.get("wind_speed"),
-                "wind_deg": item.get("wind_deg"),
-                "clouds": item.get("clouds"),
-                "rain": float(item.get("rain", {}).get("1h", 0.0) or 0.0),
-                "weather_desc": item.get("weather", [{}])[0].get("description", ""),
+            return pd.DataFrame({
+                "ts": _ts_col(hourly),
+                "temp": [item.get("temp") for item in hourly],
+                "humidity": [item.get("humidity") for item in hourly],
+                "pressure": [item.get("pressure") for item in hourly],
+                "wind_speed": [item.get("wind_speed") for item in hourly],
+                "wind_deg": [item.get("wind_deg") for item in hourly],
+                "clouds": [item.get("clouds") for item in hourly],
+                "rain": np.array([float(item.get("rain", {}).get("1h", 0.0) or 0.0) for item in hourly], dtype=float),
+                "weather_desc": _desc_col(hourly),
                 "source": self.name
-            } for item in hourly]
-            return pd.DataFrame(records)
+            })
         except Exception as e:
             print(f"⚠️ Lỗi parse dữ liệu OWM hourly: {e}")
             return pd.DataFrame()
 
-    def fetch_daily(self, lat: float, lon: float, days: int = 7) -> pd.DataFrame:
-        data = self._request(f"{self.base_url_onecall}/onecall", {
-            "lat": lat, "lon": lon, "exclude": "minutely,hourly,alerts"
-        })
-        if not data or "error" in data:
-            forecast = self._request(f"{self.base_url_current}/forecast", {"lat": lat, "lon": lon})
-            if not forecast or "list" not in forecast:
+    def _parse_daily(self, data: dict, is_onecall: bool, days: int) -> pd.DataFrame:
+        if not is_onecall:
+            if not data or "list" not in data:
                 return pd.DataFrame()
             try:
-                df = pd.DataFrame([{
-                    "ts": datetime.utcfromtimestamp(item["dt"]).replace(tzinfo=timezone.utc),
-                    "temp": item.get("main", {}).get("temp"),
-                    "humidity": item.get("main", {}).get("humidity"),
-                    "pressure": item.get("main", {}).get("pressure"),
-                    "wind_speed": item.get("wind", {}).get("speed"),
-                    "wind_deg": item.get("wind", {}).get("deg"),
-                    "clouds": item.get("clouds", {}).get("all"),
-                    "rain": float(item.get("rain", {}).get("3h", 0.0) or 0.0),
-                    "weather_desc": item.get("weather", [{}])[0].get("description", ""),
-                    "source": self.name
-                } for item in forecast.get("list", [])])
-                df["date"] = df["ts"].dt.date
-                daily = df.groupby("date").agg({
-                    "temp": ["min", "max"],
-                    "humidity": "mean",
-                    "pressure": "mean",
-                    "wind_speed": "mean",
-                    "wind_deg": "mean",
-                    "clouds": "mean",
-                    "rain": "sum"
-                }).reset_index()
-                daily.columns = ["ts", "temp_min", "temp_max", "humidity", "pressure",
-                                 "wind_speed", "wind_deg", "clouds", "rain"]
+                df = pd.DataFrame(_forecast_columns(data.get("list", []), self.name))
+                daily = _daily_from_forecast(df)
                 daily["source"] = self.name
                 return daily.head(days)
             except Exception as e:
@@ -145,32 +209,42 @@ class OpenWeatherSource:
 
         try:
             daily = data.get("daily", [])[:days]
-            records = [{
-                "ts": datetime.utcfromtimestamp(item["dt"]).replace(tzinfo=timezone.utc),
-                "temp_min": item.get("temp", {}).get("min"),
-                "temp_max": item.get("temp", {}).get("max"),
-                "humidity": item.get("humidity"),
-                "pressure": item.get("pressure"),
-                "wind_speed": item.get("wind_speed"),
-                "wind_deg": item.get("wind_deg"),
-                "clouds": item.get("clouds"),
-                "rain": float(item.get("rain", 0.0) or 0.0),
-                "weather_desc": item.get("weather", [{}])[0].get("description", ""),
+            temps = [item.get("temp", {}) for item in daily]
+            return pd.DataFrame({
+                "ts": _ts_col(daily),
+                "temp_min": [t.get("min") for t in temps],
+                "temp_max": [t.get("max") for t in temps],
+                "humidity": [item.get("humidity") for item in daily],
+                "pressure": [item.get("pressure") for item in daily],
+                "wind_speed": [item.get("wind_speed") for item in daily],
+                "wind_deg": [item.get("wind_deg") for item in daily],
+                "clouds": [item.get("clouds") for item in daily],
+                "rain": np.array([float(item.get("rain", 0.0) or 0.0) for item in daily], dtype=float),
+                "weather_desc": _desc_col(daily),
                 "source": self.name
-            } for item in daily]
-            return pd.DataFrame(records)
+            })
         except Exception as e:
             print(f"⚠️ Lỗi parse dữ liệu OWM daily: {e}")
             return pd.DataFrame()
-   
+
+    def fetch_hourly(self, lat: float, lon: float, hours: int = 24) -> pd.DataFrame:
+        return self._parse_hourly(*self._onecall(lat, lon, "minutely,daily,alerts"), hours)
+
+    def fetch_daily(self, lat: float, lon: float, days: int = 7) -> pd.DataFrame:
+        return self._parse_daily(*self._onecall(lat, lon, "minutely,hourly,alerts"), days)
+
+    def fetch_forecast(self, lat: float, lon: float, hours: int = 24, days: int = 7) -> dict:
+        """hourly + daily từ cùng một payload OneCall (hoặc forecast khi fallback), một lượt gọi mạng."""
+        data, is_onecall = self._onecall(lat, lon, "minutely,current,alerts")
+        return {
+            "hourly": self._parse_hourly(data, is_onecall, hours),
+            "daily": self._parse_daily(data, is_onecall, days),
+        }
+
     def fetch_onecall(self, lat: float, lon: float, exclude: str = "minutely,alerts") -> dict:
         """Lấy dữ liệu tổng hợp từ OneCall API v3.0, fallback sang forecast nếu unauthorized"""
-        data = self._request(f"{self.base_url_onecall}/onecall", {"lat": lat, "lon": lon, "exclude": exclude})
-        if not data or "error" in data:
-            # Fallback sang forecast 5-day/3-hour
-            forecast = self._request(f"{self.base_url_current}/forecast", {"lat": lat, "lon": lon})
-            return forecast if forecast else {}
-        return data
+        data, _ = self._onecall(lat, lon, exclude)
+        return data if data else {}
 
 # Khởi tạo instance OWM để dùng trực tiếp
 OWM = OpenWeatherSource(
@@ -26,14 +26,14 @@ def check_storm_alert(current: dict, daily_df: pd.DataFrame) -> str:
 
     # Kiểm tra mưa theo ngày
     if isinstance(daily_df, pd.DataFrame) and not daily_df.empty and "rain" in daily_df.columns:
-        heavy_rain_days = daily_df[daily_df["rain"] >= STORM_RAIN_ALERT]
-        for _, row in heavy_rain_days.iterrows():
-            ts_val = row.get("ts")
+        rain = daily_df["rain"]
+        heavy = (rain >= STORM_RAIN_ALERT).to_numpy()
+        ts_vals = daily_df["ts"][heavy] if "ts" in daily_df.columns else [None] * int(heavy.sum())
+        for ts_val, rain_val in zip(ts_vals, rain[heavy]):
             try:
                 date_txt = pd.to_datetime(ts_val, utc=True).strftime("%d/%m")
             except Exception:
                 date_txt = str(ts_val)
-            rain_val = row.get("rain", 0.0)
             alerts.append(f"⚠️ Ngày {date_txt}: dự báo mưa cực lớn {rain_val:.1f} mm, nguy cơ bão kèm theo.")
 
     # Nếu không có cảnh báo
@@ -0,0 +1,13 @@
+# services/timeutils.py
+import pandas as pd
+
+
+def ensure_ts(values) -> pd.Series:
+    """
+    Chuẩn hóa cột thời gian về datetime64 UTC.
+    - Đã là datetime có múi giờ (nguồn trả về sẵn) → không parse lại
+    - Còn lại: pd.to_datetime(errors="coerce", utc=True)
+    """
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.DatetimeTZDtype):
+        return values if str(values.dt.tz) == "UTC" else values.dt.tz_convert("UTC")
+    return pd.to_datetime(values, errors="coerce", utc=True)
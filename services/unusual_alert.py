@@ -1,8 +1,13 @@
 # services/unusual_alert.py
+import re
+import unicodedata
+from functools import lru_cache
+
 import pandas as pd
 
-# Danh sách hiện tượng bất thường cần cảnh báo (bao gồm cả giả tưởng)
-UNUSUAL_EVENTS = [
+# Danh sách hiện tượng bất thường cần cảnh báo (bao gồm cả giả tưởng).
+# Tuple: regex/từ khóa bỏ dấu bên dưới và cache _matched_events được dựng một lần lúc import từ danh sách này
+UNUSUAL_EVENTS = (
     "sấm sét",
     "dông tố",
     "mưa đá",
@@ -23,7 +28,45 @@ UNUSUAL_EVENTS = [
     "sương muối",
     "hạn hán cực đoan",
     "cháy rừng",
-]
+)
+
+# đ/Đ không tách dấu khi normalize NFD → đổi tay trước khi bỏ dấu
+_D_TABLE = str.maketrans({"đ": "d", "Đ": "d"})
+
+
+def _fold(text: str) -> str:
+    """lower + bỏ dấu tiếng Việt (đ → d) để so khớp không phân biệt dấu: "Dông tố" / "dong to" → "dong to"."""
+    text = unicodedata.normalize("NFD", text.lower().translate(_D_TABLE))
+    return text.encode("ascii", "ignore").decode("ascii")
+
+
+# Từ khóa đã bỏ dấu (cùng thứ tự UNUSUAL_EVENTS), khớp trọn từ: bỏ dấu rồi thì "dong to" không được
+# khớp vào "dong toi" (đông tối). Một regex gộp cả danh sách để lọc: mô tả chỉ search một lần.
+UNUSUAL_FOLDED = tuple(_fold(event) for event in UNUSUAL_EVENTS)
+EVENT_PATTERNS = tuple(re.compile(rf"\b{re.escape(key)}\b") for key in UNUSUAL_FOLDED)
+UNUSUAL_PATTERN = re.compile(r"\b(?:" + "|".join(map(re.escape, UNUSUAL_FOLDED)) + r")\b")
+
+
+@lru_cache(maxsize=2048)
+def _matched_events(desc: str) -> tuple:
+    """
+    Các hiện tượng có trong mô tả (có dấu hay không dấu đều khớp), theo thứ tự UNUSUAL_EVENTS.
+    Mô tả lặp lại rất nhiều ("Mưa nhẹ", "Nhiều mây"...) → cache theo chuỗi gốc, lần sau không chuẩn hóa/quét lại.
+    """
+    desc = _fold(desc)
+    if not UNUSUAL_PATTERN.search(desc):
+        return ()
+    return tuple(event for event, pattern in zip(UNUSUAL_EVENTS, EVENT_PATTERNS) if pattern.search(desc))
+
+
+def _unusual_rows(df: pd.DataFrame):
+    """Sinh (ts, các hiện tượng) cho các dòng có weather_desc chứa hiện tượng bất thường."""
+    ts_vals = df["ts"] if "ts" in df.columns else [None] * len(df)
+    for ts_val, desc in zip(ts_vals, df["weather_desc"]):
+        events = _matched_events(str(desc))
+        if events:
+            yield ts_val, events
+
 
 def check_unusual_alert(current: dict, hourly_df: pd.DataFrame, daily_df: pd.DataFrame) -> str:
     """
@@ -35,36 +78,26 @@ def check_unusual_alert(current: dict, hourly_df: pd.DataFrame, daily_df: pd.Dat
     alerts = []
 
     # Kiểm tra mô tả thời tiết hiện tại
-    desc = str(current.get("weather_desc", "")).lower()
-    for event in UNUSUAL_EVENTS:
-        if event in desc:
-            alerts.append(f"⚠️ Hiện tượng bất thường phát hiện: {event.capitalize()} trong điều kiện hiện tại.")
+    for event in _matched_events(str(current.get("weather_desc", ""))):
+        alerts.append(f"⚠️ Hiện tượng bất thường phát hiện: {event.capitalize()} trong điều kiện hiện tại.")
 
     # Kiểm tra dữ liệu theo giờ
     if isinstance(hourly_df, pd.DataFrame) and not hourly_df.empty and "weather_desc" in hourly_df.columns:
-        for _, row in hourly_df.iterrows():
-            desc_hour = str(row.get("weather_desc", "")).lower()
-            for event in UNUSUAL_EVENTS:
-                if event in desc_hour:
-                    ts_val = row.get("ts")
-                    try:
-                        ts = pd.to_datetime(ts_val, utc=True).strftime("%d/%m %H:%M")
-                    except Exception:
-                        ts = str(ts_val)
-                    alerts.append(f"⚠️ {ts}: dự báo xuất hiện {event}.")
+        for ts_val, events in _unusual_rows(hourly_df):
+            try:
+                ts = pd.to_datetime(ts_val, utc=True).strftime("%d/%m %H:%M")
+            except Exception:
+                ts = str(ts_val)
+            alerts.extend(f"⚠️ {ts}: dự báo xuất hiện {event}." for event in events)
 
     # Kiểm tra dữ liệu theo ngày
     if isinstance(daily_df, pd.DataFrame) and not daily_df.empty and "weather_desc" in daily_df.columns:
-        for _, row in daily_df.iterrows():
-            desc_day = str(row.get("weather_desc", "")).lower()
-            for event in UNUSUAL_EVENTS:
-                if event in desc_day:
-                    ts_val = row.get("ts")
-                    try:
-                        ts = pd.to_datetime(ts_val, utc=True).strftime("%d/%m")
-                    except Exception:
-                        ts = str(ts_val)
-                    alerts.append(f"⚠️ Ngày {ts}: dự báo có {event}.")
+        for ts_val, events in _unusual_rows(daily_df):
+            try:
+                ts = pd.to_datetime(ts_val, utc=True).strftime("%d/%m")
+            except Exception:
+                ts = str(ts_val)
+            alerts.extend(f"⚠️ Ngày {ts}: dự báo có {event}." for event in events)
 
     if not alerts:
         return "✅ Không phát hiện hiện tượng bất thường trong dữ liệu hiện tại."
@@ -2,10 +2,19 @@
 from dotenv import load_dotenv
 load_dotenv()
 import os
-import requests
+import orjson
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
 
+from services.http_client import get_content
+
+
+def _epoch_col(items: list, key: str) -> pd.DatetimeIndex:
+    """Cột thời gian UTC từ epoch giây của cả danh sách (một lần chuyển đổi)."""
+    return pd.to_datetime(np.fromiter((item.get(key, 0) for item in items), dtype=np.int64, count=len(items)), unit="s", utc=True)
+
+
 class WeatherAPISource:
     def __init__(self, name: str, base_url: str, api_key: str | None, lang="vi", units="metric"):
         self.name = name
@@ -21,9 +30,7 @@ class WeatherAPISource:
         params["key"] = self.api_key
         params["lang"] = self.lang
         try:
-            resp = requests.get(url, params=params, timeout=20)
-            resp.raise_for_status()
-            return resp.json()
+            return orjson.loads(get_content(url, params))
         except Exception as e:
             print(f"⚠️ Lỗi khi gọi WeatherAPI ({endpoint}): {e}")
             return {}
@@ -37,7 +44,7 @@ class WeatherAPISource:
             loc = data.get("location", {})
             c = data.get("current", {})
             return {
-                "ts": datetime.utcfromtimestamp(c.get("last_updated_epoch", 0)).replace(tzinfo=timezone.utc),
+                "ts": datetime.fromtimestamp(c.get("last_updated_epoch", 0), timezone.utc),
                 "temp": c.get("temp_c"),
                 "humidity": c.get("humidity"),
                 "pressure": c.get("pressure_mb"),
@@ -54,79 +61,82 @@ class WeatherAPISource:
             print(f"⚠️ Lỗi parse dữ liệu WeatherAPI current: {e}")
             return {}
 
-    def fetch_hourly(self, lat: float, lon: float, hours: int = 24) -> pd.DataFrame:
-        data = self._request("forecast.json", {
+    def _forecast(self, lat: float, lon: float, days: int) -> dict:
+        """Một request forecast.json: chứa cả dự báo giờ (forecastday[].hour) lẫn ngày (forecastday[].day)."""
+        return self._request("forecast.json", {
             "q": f"{lat},{lon}",
-            "days": 2,
+            "days": days,
             "aqi": "no",
             "alerts": "no"
         })
+
+    def _parse_hourly(self, data: dict, hours: int) -> pd.DataFrame:
         if not data:
             return pd.DataFrame()
 
         try:
             forecastdays = data.get("forecast", {}).get("forecastday", [])
-            records = []
-            for day in forecastdays:
-                for h in day.get("hour", []):
-                    records.append({
-                        "ts": datetime.utcfromtimestamp(h.get("time_epoch", 0)).replace(tzinfo=timezone.utc),
-                        "temp": h.get("temp_c"),
-                        "humidity": h.get("humidity"),
-                        "pressure": h.get("pressure_mb"),
-                        "wind_speed": (h.get("wind_kph", 0) or 0) / 3.6,
-                        "wind_deg": h.get("wind_degree"),
-                        "clouds": h.get("cloud"),
-                        "rain": float(h.get("precip_mm", 0.0) or 0.0),
-                        "weather_desc": h.get("condition", {}).get("text", ""),
-                        "source": self.name
-                    })
-            return pd.DataFrame(records[:hours])
+            hrs = [h for day in forecastdays for h in day.get("hour", [])][:hours]
+            # Dựng theo cột: mỗi trường một lượt trên danh sách giờ
+            return pd.DataFrame({
+                "ts": _epoch_col(hrs, "time_epoch"),
+                "temp": [h.get("temp_c") for h in hrs],
+                "humidity": [h.get("humidity") for h in hrs],
+                "pressure": [h.get("pressure_mb") for h in hrs],
+                "wind_speed": np.array([(h.get("wind_kph", 0) or 0) / 3.6 for h in hrs], dtype=float),
+                "wind_deg": [h.get("wind_degree") for h in hrs],
+                "clouds": [h.get("cloud") for h in hrs],
+                "rain": np.array([float(h.get("precip_mm", 0.0) or 0.0) for h in hrs], dtype=float),
+                "weather_desc": [h.get("condition", {}).get("text", "") for h in hrs],
+                "source": self.name
+            })
         except Exception as e:
             print(f"⚠️ Lỗi parse dữ liệu WeatherAPI hourly: {e}")
             return pd.DataFrame()
 
-    def fetch_daily(self, lat: float, lon: float, days: int = 7) -> pd.DataFrame:
-        data = self._request("forecast.json", {
-            "q": f"{lat},{lon}",
-            "days": days,
-            "aqi": "no",
-            "alerts": "no"
-        })
+    def _parse_daily(self, data: dict) -> pd.DataFrame:
         if not data:
             return pd.DataFrame()
 
         try:
             forecastdays = data.get("forecast", {}).get("forecastday", [])
-            records = []
-            for day in forecastdays:
-                d = day.get("day", {})
-                temp_min = d.get("mintemp_c")
-                temp_max = d.get("maxtemp_c")
-                temp_avg = d.get("avgtemp_c")
-
-                # In log cảnh báo nếu min/max bị None
-                if temp_min is None or temp_max is None:
+            ds = [day.get("day", {}) for day in forecastdays]
+            temp_min = [d.get("mintemp_c") for d in ds]
+            temp_max = [d.get("maxtemp_c") for d in ds]
+
+            # In log cảnh báo nếu min/max bị None
+            for day, tmin, tmax in zip(forecastdays, temp_min, temp_max):
+                if tmin is None or tmax is None:
                     print(f"⚠️ Cảnh báo: Thiếu dữ liệu min/max cho ngày {day.get('date')}")
 
-                records.append({
-                    "ts": datetime.utcfromtimestamp(day.get("date_epoch", 0)).replace(tzinfo=timezone.utc),
-                    "temp_min": temp_min,
-                    "temp_max": temp_max,
-                    "temp_avg": temp_avg,
-                    "humidity": d.get("avghumidity"),
-                    "pressure": None,
-                    "wind_speed": (d.get("maxwind_kph", 0) or 0) / 3.6,
-                    "clouds": None,
-                    "rain": float(d.get("totalprecip_mm", 0.0) or 0.0),
-                    "weather_desc": d.get("condition", {}).get("text", ""),
-                    "source": self.name
-                })
-            return pd.DataFrame(records)
+            return pd.DataFrame({
+                "ts": _epoch_col(forecastdays, "date_epoch"),
+                "temp_min": temp_min,
+                "temp_max": temp_max,
+                "temp_avg": [d.get("avgtemp_c") for d in ds],
+                "humidity": [d.get("avghumidity") for d in ds],
+                "pressure": None,
+                "wind_speed": np.array([(d.get("maxwind_kph", 0) or 0) / 3.6 for d in ds], dtype=float),
+                "clouds": None,
+                "rain": np.array([float(d.get("totalprecip_mm", 0.0) or 0.0) for d in ds], dtype=float),
+                "weather_desc": [d.get("condition", {}).get("text", "") for d in ds],
+                "source": self.name
+            })
         except Exception as e:
             print(f"⚠️ Lỗi parse dữ liệu WeatherAPI daily: {e}")
             return pd.DataFrame()
 
+    def fetch_hourly(self, lat: float, lon: float, hours: int = 24) -> pd.DataFrame:
+        return self._parse_hourly(self._forecast(lat, lon, days=2), hours)
+
+    def fetch_daily(self, lat: float, lon: float, days: int = 7) -> pd.DataFrame:
+        return self._parse_daily(self._forecast(lat, lon, days=days))
+
+    def fetch_forecast(self, lat: float, lon: float, hours: int = 24, days: int = 7) -> dict:
+        """hourly + daily từ cùng một response forecast.json (một lượt gọi mạng thay vì hai)."""
+        data = self._forecast(lat, lon, days=max(days, 2))
+        return {"hourly": self._parse_hourly(data, hours), "daily": self._parse_daily(data).head(days)}
+
 # Khởi tạo instance để dùng trong app
 WeatherAPI = WeatherAPISource(
     name="weatherapi",